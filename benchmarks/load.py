@@ -0,0 +1,185 @@
+"""
+Load test: feature churn against a local stand-in server while threads evaluate.
+
+Run from the repository root::
+
+    python -m benchmarks.load --features 10000 --updates 20 --threads 8 --duration 30
+
+A churn thread flips features on the stand-in server, which pushes each new
+feature set over ``/event-stream`` (or serves it to pollers with
+``--polling``). Meanwhile ``--threads`` threads call ``is_active`` with
+``auto_send_events`` on. The report gives flag propagation latency
+percentiles, evaluation ops/sec, the analytics ingest rate seen by the
+server and memory over time, as JSON.
+"""
+
+import argparse
+import json
+import os
+import random
+import resource
+import sys
+import threading
+import time
+
+from molasses import MolassesClient
+
+from .run import make_constraints, make_feature
+from .stub_server import StubServer
+
+
+def rss_bytes():
+    """Current resident set size, or the peak where the current one cannot be read."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+
+
+def percentiles(values, points=(50, 90, 99)):
+    if not values:
+        return {}
+    values = sorted(values)
+    result = {"p%d" % p: values[min(len(values) - 1, int(len(values) * p / 100))] for p in points}
+    result["max"] = values[-1]
+    return result
+
+
+class Churn:
+    """Publishes one changed feature every ``1 / rate`` seconds and records when."""
+
+    def __init__(self, server, features, rate):
+        self.server = server
+        self.features = {feature["key"]: feature for feature in features}
+        self.keys = list(self.features)
+        self.rate = rate
+        self.published = {}
+        self.latencies = []
+        self.updates = 0
+        self.__lock = threading.Lock()
+        self.__stopped = threading.Event()
+        self.__thread = threading.Thread(target=self.__run, name="molasses-load-churn")
+        self.__thread.daemon = True
+
+    def start(self):
+        self.__thread.start()
+
+    def stop(self):
+        self.__stopped.set()
+        self.__thread.join()
+
+    def on_change(self, keys):
+        now = time.perf_counter()
+        with self.__lock:
+            for key in keys:
+                published_at = self.published.pop(key, None)
+                if published_at is not None:
+                    self.latencies.append(now - published_at)
+
+    def __run(self):
+        interval = 1.0 / self.rate
+        next_at = time.perf_counter()
+        rng = random.Random(1)
+        while not self.__stopped.wait(max(next_at - time.perf_counter(), 0)):
+            key = rng.choice(self.keys)
+            feature = dict(self.features[key], active=not self.features[key]["active"])
+            self.features[key] = feature
+            with self.__lock:
+                self.published.setdefault(key, time.perf_counter())
+            self.server.publish([feature])
+            self.updates += 1
+            next_at += interval
+
+
+def evaluate(client, keys, deadline, counts, index):
+    rng = random.Random(index)
+    users = [{"id": "user-%d" % i, "params": {"p0": "m", "p1": "m"}} for i in range(1000)]
+    count = 0
+    while time.perf_counter() < deadline:
+        for _ in range(1000):
+            client.is_active(rng.choice(keys), rng.choice(users))
+        count += 1000
+        counts[index] = count
+
+
+def run_load(features=1000, updates=10.0, threads=4, duration=10.0, polling=False,
+             sample_interval=1.0):
+    raw = [make_feature("feature_%d" % i, make_constraints(2, "string", "equals", "m"))
+           for i in range(features)]
+    keys = [feature["key"] for feature in raw]
+    with StubServer(raw) as server:
+        start = time.perf_counter()
+        client = MolassesClient("load", base_url=server.base_url, polling=polling,
+                                polling_interval=0.5, polling_max_interval=0.5,
+                                auto_send_events=True, events_batch_size=500, events_linger=0.1)
+        client.wait_until_ready(30)
+        startup = time.perf_counter() - start
+
+        churn = Churn(server, raw, updates)
+        client.on_change(churn.on_change)
+        counts = [0] * threads
+        deadline = time.perf_counter() + duration
+        workers = [threading.Thread(target=evaluate, args=(client, keys, deadline, counts, i))
+                   for i in range(threads)]
+        start = time.perf_counter()
+        churn.start()
+        for worker in workers:
+            worker.start()
+
+        samples = []
+        while time.perf_counter() < deadline:
+            samples.append({
+                "seconds": time.perf_counter() - start,
+                "rss_bytes": rss_bytes(),
+                "snapshot_version": client.snapshot.version,
+                "evaluations": sum(counts),
+                "events_received": server.events_received,
+            })
+            time.sleep(min(sample_interval, max(deadline - time.perf_counter(), 0)))
+        for worker in workers:
+            worker.join()
+        churn.stop()
+        elapsed = time.perf_counter() - start
+        events_received = server.events_received
+        client.stop()
+
+    return {
+        "params": {"features": features, "updates_per_second": updates, "threads": threads,
+                   "duration": duration, "mode": "polling" if polling else "stream"},
+        "startup_seconds": startup,
+        "updates_published": churn.updates,
+        "updates_observed": len(churn.latencies),
+        "propagation_seconds": percentiles(churn.latencies),
+        "evaluations_per_second": sum(counts) / elapsed,
+        "analytics_events_per_second": events_received / elapsed,
+        "analytics_events_dropped": client.events.dropped,
+        "memory": samples,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--features", type=int, default=1000, help="number of features served")
+    parser.add_argument("--updates", type=float, default=10.0, help="feature updates per second")
+    parser.add_argument("--threads", type=int, default=4, help="threads calling is_active")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds to run for")
+    parser.add_argument("--polling", action="store_true", help="poll /features instead of streaming")
+    parser.add_argument("--output", "-o", help="write the JSON report to this file instead of stdout")
+    args = parser.parse_args(argv)
+
+    report = run_load(args.features, args.updates, args.threads, args.duration, args.polling)
+    print("propagation %s, %.0f evaluations/s, %.0f events/s" % (
+        json.dumps(report["propagation_seconds"]), report["evaluations_per_second"],
+        report["analytics_events_per_second"]), file=sys.stderr)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,261 @@
+"""
+Benchmarks for the evaluation hot path and the I/O paths.
+
+Run from the repository root::
+
+    python -m benchmarks.run --output benchmark.json
+
+Results are written as JSON so they can be compared across releases.
+Pass ``--quick`` for a fast smoke run with fewer iterations.
+"""
+
+import argparse
+import json
+import platform
+import statistics
+import sys
+import threading
+import time
+import timeit
+
+import molasses
+from molasses import MolassesClient
+from molasses.evaluation import get_user_percentage
+from molasses.snapshot import EMPTY_SNAPSHOT, updated_snapshot
+
+from .stub_server import StubServer
+
+CONSTRAINT_COUNTS = (0, 10, 100)
+
+# userParamType -> (constraint value, {operator: user value that meets the constraint})
+OPERATORS = {
+    "string": ("m", {"equals": "m", "doesNotEqual": "z", "in": "m", "nin": "z", "contains": "m",
+                     "doesNotContain": "z", "gt": "n", "gte": "m", "lt": "l", "lte": "m"}),
+    "number": (10, {"equals": 10, "doesNotEqual": 11, "gt": 11, "gte": 10, "lt": 9, "lte": 10}),
+    "boolean": (True, {"equals": True, "doesNotEqual": False}),
+    "semver": ("1.2.0", {"equals": "1.2.0", "doesNotEqual": "1.3.0", "gt": "1.3.0",
+                         "gte": "1.2.0", "lt": "1.1.0", "lte": "1.2.0"}),
+}
+
+
+def make_feature(key, constraints, percentage=50):
+    return {
+        "id": key,
+        "key": key,
+        "active": True,
+        "description": "benchmark feature",
+        "segments": [
+            {
+                "constraint": "all",
+                "percentage": 100,
+                "segmentType": "alwaysExperiment",
+                "userConstraints": constraints,
+            },
+            {
+                "constraint": "all",
+                "percentage": percentage,
+                "segmentType": "everyoneElse",
+                "userConstraints": [],
+            },
+        ],
+    }
+
+
+def make_constraints(count, param_type, operator, value):
+    constraints = []
+    for i in range(count):
+        constraint = {"userParam": "p%d" % i, "operator": operator, "values": value}
+        if param_type != "string":
+            constraint["userParamType"] = param_type
+        constraints.append(constraint)
+    return constraints
+
+
+class Runner:
+    def __init__(self, quick=False):
+        self.quick = quick
+        self.results = []
+
+    def measure(self, name, fn, **params):
+        timer = timeit.Timer(fn)
+        if self.quick:
+            number, repeat = 100, 1
+        else:
+            number, _ = timer.autorange()
+            repeat = 5
+        per_call = [t / number for t in timer.repeat(repeat, number)]
+        result = {
+            "name": name,
+            "params": params,
+            "number": number,
+            "repeat": repeat,
+            "min_seconds": min(per_call),
+            "median_seconds": statistics.median(per_call),
+            "ops_per_second": 1 / min(per_call) if min(per_call) else None,
+        }
+        self.results.append(result)
+        print("%-28s %-55s %12.0f ops/s" % (name, json.dumps(params, sort_keys=True),
+                                            result["ops_per_second"] or 0), file=sys.stderr)
+        return result
+
+    def record(self, name, **values):
+        self.results.append(dict(name=name, **values))
+        print("%-28s %s" % (name, json.dumps(values, sort_keys=True)), file=sys.stderr)
+
+
+def bench_is_active(runner):
+    features = []
+    cases = []
+    for param_type, (value, user_values) in OPERATORS.items():
+        for operator, user_value in user_values.items():
+            for count in CONSTRAINT_COUNTS:
+                key = "%s_%s_%d" % (param_type, operator, count)
+                features.append(make_feature(key, make_constraints(count, param_type, operator, value)))
+                params = {"p%d" % i: user_value for i in range(count)}
+                cases.append((key, param_type, operator, count, {"id": "user-1", "params": params}))
+    for size in (10, 10000):
+        values = ",".join("user-%d" % i for i in range(size))
+        key = "in_list_%d" % size
+        features.append(make_feature(key, [{"userParam": "id", "operator": "in", "values": values}]))
+
+    with StubServer(features) as server:
+        client = MolassesClient("bench", polling=True, base_url=server.base_url)
+        try:
+            for key, param_type, operator, count, user in cases:
+                runner.measure("is_active", lambda: client.is_active(key, user),
+                               userParamType=param_type, operator=operator, constraints=count)
+            for size in (10, 10000):
+                key = "in_list_%d" % size
+                hit = {"id": "user-%d" % (size - 1), "params": {}}
+                miss = {"id": "someone-else", "params": {}}
+                runner.measure("is_active_in_list", lambda: client.is_active(key, hit),
+                               values=size, match=True)
+                runner.measure("is_active_in_list", lambda: client.is_active(key, miss),
+                               values=size, match=False)
+        finally:
+            client.stop()
+
+
+def bench_user_percentage(runner):
+    runner.measure("get_user_percentage", lambda: get_user_percentage("user-1234567", 50))
+
+
+def bench_snapshot_replacement(runner):
+    for size in (1000, 10000):
+        features = [make_feature("feature_%d" % i, make_constraints(2, "string", "in", "a,b,c"))
+                    for i in range(size)]
+        snapshot, _ = updated_snapshot(EMPTY_SNAPSHOT, features)
+        changed = list(features)
+        changed[0] = make_feature("feature_0", [], percentage=10)
+        number = 1 if runner.quick else 3
+        for name, base, incoming in (("full", EMPTY_SNAPSHOT, features),
+                                     ("unchanged", snapshot, features),
+                                     ("one_changed", snapshot, changed)):
+            elapsed = min(timeit.repeat(lambda: updated_snapshot(base, incoming), number=1, repeat=number))
+            runner.record("snapshot_replacement", params={"features": size, "case": name},
+                          seconds=elapsed)
+
+
+def bench_analytics(runner):
+    count = 1000 if runner.quick else 20000
+    with StubServer([]) as server:
+        client = MolassesClient("bench", polling=True, base_url=server.base_url,
+                                events_batch_size=200, events_linger=0.05,
+                                events_queue_size=count)
+        user = {"id": "user-1", "params": {"plan": "pro"}}
+        try:
+            start = time.perf_counter()
+            for i in range(count):
+                client.track("Clicked button", user)
+            enqueued = time.perf_counter() - start
+            client.events.flush()
+            elapsed = time.perf_counter() - start
+        finally:
+            client.stop()
+        runner.record("analytics_throughput", params={"events": count},
+                      track_seconds_per_call=enqueued / count,
+                      events_per_second=server.events_received / elapsed,
+                      events_received=server.events_received,
+                      requests=server.analytics_requests)
+
+
+def gil_enabled():
+    is_gil_enabled = getattr(sys, "_is_gil_enabled", None)
+    return True if is_gil_enabled is None else is_gil_enabled()
+
+
+def bench_threads(runner):
+    calls = 2000 if runner.quick else 200000
+    features = [make_feature("feature_%d" % i, make_constraints(10, "string", "equals", "m"))
+                for i in range(100)]
+    keys = [feature["key"] for feature in features]
+    users = [{"id": "user-%d" % i, "params": {"p%d" % j: "m" for j in range(10)}} for i in range(100)]
+
+    def evaluate(client, start):
+        start.wait()
+        for i in range(calls):
+            client.is_active(keys[i % len(keys)], users[i % len(users)])
+
+    with StubServer(features) as server:
+        client = MolassesClient("bench", polling=True, base_url=server.base_url)
+        try:
+            baseline = None
+            for count in (1, 2, 4, 8):
+                start = threading.Barrier(count + 1)
+                threads = [threading.Thread(target=evaluate, args=(client, start)) for _ in range(count)]
+                for thread in threads:
+                    thread.start()
+                start.wait()
+                began = time.perf_counter()
+                for thread in threads:
+                    thread.join()
+                ops = count * calls / (time.perf_counter() - began)
+                baseline = baseline or ops
+                runner.record("is_active_threads", params={"threads": count, "gil_enabled": gil_enabled()},
+                              ops_per_second=ops, speedup=ops / baseline)
+        finally:
+            client.stop()
+
+
+BENCHMARKS = {
+    "is_active": bench_is_active,
+    "user_percentage": bench_user_percentage,
+    "snapshot": bench_snapshot_replacement,
+    "analytics": bench_analytics,
+    "threads": bench_threads,
+}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--output", "-o", help="write JSON results to this file instead of stdout")
+    parser.add_argument("--quick", action="store_true", help="run few iterations, for smoke testing")
+    parser.add_argument("--only", action="append", choices=sorted(BENCHMARKS),
+                        help="run only the named benchmark group, may be repeated")
+    args = parser.parse_args(argv)
+
+    runner = Runner(quick=args.quick)
+    for name, bench in BENCHMARKS.items():
+        if not args.only or name in args.only:
+            bench(runner)
+
+    report = {
+        "molasses_version": molasses.__version__,
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "platform": platform.platform(),
+        "gil_enabled": gil_enabled(),
+        "timestamp": time.time(),
+        "quick": args.quick,
+        "results": runner.results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+"""Local stand-in for the Molasses API, used by the benchmarks."""
+
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+
+class StubServer(ThreadingMixIn, HTTPServer):
+    """
+    Serves ``/v1/features`` and ``/v1/event-stream`` from the current
+    features and counts the events posted to ``/v1/analytics``. Runs on a
+    free localhost port in a daemon thread; ``base_url`` is the URL to pass
+    to the client.
+
+    ``publish`` replaces some features and pushes the new feature set to
+    every open event stream. Each feature is encoded once per revision, so
+    publishing to large feature sets only pays for joining the payload.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, features=None):
+        super().__init__(("127.0.0.1", 0), StubHandler)
+        self.events_received = 0
+        self.analytics_requests = 0
+        self.lock = threading.Lock()
+        self.published = threading.Condition(self.lock)
+        self.version = 0
+        self.stopping = False
+        self.__encoded = {}
+        self.__payload = b""
+        self.publish(features or [])
+        self.thread = threading.Thread(target=self.serve_forever, name="molasses-stub")
+        self.thread.daemon = True
+
+    @property
+    def base_url(self):
+        return "http://127.0.0.1:%d/v1" % self.server_address[1]
+
+    @property
+    def features(self):
+        return [json.loads(encoded) for encoded in self.__encoded.values()]
+
+    @property
+    def payload(self):
+        """The current ``/features`` response body, and the version it belongs to."""
+        with self.lock:
+            return self.version, self.__payload
+
+    def publish(self, features, removed=()):
+        """Adds or replaces ``features``, removes the keys in ``removed`` and notifies the streams."""
+        encoded = [(feature["key"], json.dumps(feature)) for feature in features]
+        with self.lock:
+            for key, value in encoded:
+                self.__encoded[key] = value
+            for key in removed:
+                self.__encoded.pop(key, None)
+            self.__payload = ('{"data":{"features":[%s]}}' % ",".join(self.__encoded.values())).encode("utf-8")
+            self.version += 1
+            self.published.notify_all()
+            return self.version
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        with self.lock:
+            self.stopping = True
+            self.published.notify_all()
+        self.shutdown()
+        self.server_close()
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status, payload):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path.startswith("/v1/features"):
+            _, body = self.server.payload
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        elif self.path.startswith("/v1/event-stream"):
+            self.stream_events()
+        else:
+            self.send_json(404, {})
+
+    def stream_events(self):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        server = self.server
+        sent = None
+        try:
+            while True:
+                with server.lock:
+                    server.published.wait_for(lambda: server.stopping or server.version != sent)
+                    if server.stopping:
+                        break
+                version, body = server.payload
+                chunk = b"id: %d\ndata: %s\n\n" % (version, body)
+                self.wfile.write(b"%x\r\n%s\r\n" % (len(chunk), chunk))
+                self.wfile.flush()
+                sent = version
+            self.wfile.write(b"0\r\n\r\n")
+        except OSError:
+            pass
+        self.close_connection = True
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if self.path.startswith("/v1/analytics"):
+            events = json.loads(body)
+            with self.server.lock:
+                self.server.analytics_requests += 1
+                self.server.events_received += len(events) if isinstance(events, list) else 1
+            self.send_json(200, {})
+        else:
+            self.send_json(404, {})
@@ -4,6 +4,7 @@ import os
 from molasses import MolassesClient
 logging.basicConfig(level=os.environ.get("LOGLEVEL", "INFO"))
 client = MolassesClient(os.environ.get('MOLASSES_API_KEY'))
+client.wait_until_ready(timeout=10)
 logger = logging.getLogger()
 logger.setLevel(logging.DEBUG)
 count = 0
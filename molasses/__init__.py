@@ -7,284 +7,478 @@ __version__ = '0.1.2'
 import logging
 import requests
 from random import random
-import zlib
 import json
-import sseclient
-import math
 import threading
 import time
-import semver
-from typing import Dict, Optional
-from apscheduler.schedulers.background import BackgroundScheduler
-from apscheduler.triggers.interval import IntervalTrigger
+from typing import Callable, Dict, List, Optional
+from .cache import ResultCache
+from .evaluation import feature_index_size, is_feature_active
+from .metrics import Instrumentation
+from .polling import AdaptiveInterval, PollingThread
+from .shared import LeaderLock, file_version, heartbeat_path, heartbeat_time, touch_heartbeat
+from .snapshot import (EMPTY_SNAPSHOT, SOURCE_DISK, SOURCE_NETWORK, FeatureSnapshot, read_snapshot_file,
+                       save_snapshot_file, updated_snapshot)
+from .stream import (STATE_BACKOFF, STATE_CONNECTED, STATE_CONNECTING, STATE_DISCONNECTED, STATE_STOPPED,
+                     ReconnectBackoff)
+from .events import EventLimiter, EventQueue, ExposureFilter, OVERFLOW_DROP, experiment_event, track_event
+from .transport import BASE_URL, Transport
+from .user import UserContext
 logger = logging.getLogger(__name__)
 
-BASE_URL = 'https://sdk.molasses.app/v1'
-
 
 class MolassesClient:
     """
     docstring
     """
-    __cache = {}
-    __initialized = False
-    __polling = False
-    __sseclient = None
-    __retry_count = 0
 
-    def __init__(self, api_key: str, auto_send_events=False, polling=False, base_url=BASE_URL):
+    def __init__(self, api_key: str, auto_send_events=False, polling=False, base_url=BASE_URL,
+                 events_batch_size=100, events_linger=1.0, events_queue_size=10000,
+                 events_overflow=OVERFLOW_DROP, transport: Optional[Transport] = None,
+                 result_cache_size=0, result_cache_ttl=None, snapshot_path: Optional[str] = None,
+                 bootstrap_timeout: Optional[float] = None, polling_interval=15,
+                 polling_max_interval=60, polling_jitter=0.1, shared_snapshot=False,
+                 shared_snapshot_interval=1.0, stream_idle_timeout: Optional[float] = 90.0,
+                 instrumentation: Optional[Instrumentation] = None,
+                 exposure_window: Optional[float] = None, exposure_cache_size=100000,
+                 events_sample_rates: Optional[Dict[str, float]] = None,
+                 events_rate_limit: Optional[float] = None, events_burst: Optional[float] = None,
+                 features_file: Optional[str] = None, features_file_interval=1.0,
+                 events_file: Optional[str] = None):
         self.api_key = api_key
+        self.__snapshot = EMPTY_SNAPSHOT
+        self.__update_lock = threading.Lock()
+        self.__ready = threading.Event()
+        self.__ready_callbacks = []
+        self.__change_callbacks = []
+        self.snapshot_path = snapshot_path
+        self.__raw_features = {}
+        self.__writes_snapshot = True
+        self.__shared_version = None
+        self.__heartbeat_interval = shared_snapshot_interval
+        self.__heartbeat_at = 0.0
+        if shared_snapshot and snapshot_path is None:
+            raise ValueError("shared_snapshot requires a snapshot_path")
+        if snapshot_path is not None:
+            self.__shared_version = file_version(snapshot_path)
+            self.__load_snapshot_file()
         self.auto_send_events = auto_send_events
         self.base_url = base_url
-        self.scheduler = BackgroundScheduler()
+        self.transport = transport
+        if transport is None and features_file is None:
+            self.transport = Transport(api_key, base_url, stream_read_timeout=stream_idle_timeout)
+        self.instrumentation = instrumentation
+        self.result_cache = None
+        if result_cache_size > 0:
+            self.result_cache = ResultCache(result_cache_size, result_cache_ttl)
+        self.exposures = None
+        if exposure_window is not None:
+            self.exposures = ExposureFilter(exposure_window, exposure_cache_size)
+        self.event_limiter = None
+        if events_sample_rates or events_rate_limit is not None:
+            self.event_limiter = EventLimiter(events_sample_rates, rate_limit=events_rate_limit,
+                                              burst=events_burst)
+        send_events = self.__post_events
+        if events_file is not None:
+            from .offline import JsonlEventSink
+            send_events = JsonlEventSink(events_file).send
+        elif features_file is not None:
+            from .offline import discard_events
+            send_events = discard_events
+        self.events = EventQueue(send_events, max_size=events_queue_size,
+                                 batch_size=events_batch_size, linger=events_linger,
+                                 overflow=events_overflow)
         self.polling = polling
+        self.polling_interval = AdaptiveInterval(polling_interval, max(polling_interval, polling_max_interval),
+                                                 jitter=polling_jitter)
+        self.__poller = None
+        self.__etag = None
+        self.__leader_lock = None
+        self.__follower = None
+        self.__stream_response = None
+        self.__stream_stopped = threading.Event()
+        self.__last_event_id = None
+        self.__connection_state = STATE_DISCONNECTED
+        self.reconnect_backoff = ReconnectBackoff()
+        self.reconnect_count = 0
+        self.features_file = features_file
+        self.__file_watcher = None
         logger.propagate = True
+        if features_file is not None:
+            from .offline import FileWatcher
+            self.__file_watcher = FileWatcher(features_file, self.__load_features_file, features_file_interval)
+            self.__load_features_file()
+            self.__file_watcher.start()
+            return
+        if shared_snapshot:
+            self.__leader_lock = LeaderLock(snapshot_path + ".lock")
+            if not self.__leader_lock.try_acquire():
+                logger.info("Following the Molasses features shared in %s", snapshot_path)
+                self.__writes_snapshot = False
+                self.__follower = PollingThread(self.__follow_shared_snapshot, AdaptiveInterval(
+                    shared_snapshot_interval, shared_snapshot_interval))
+                self.__follower.start()
+                return
+        self.__connect(bootstrap_timeout)
+
+    def __connect(self, bootstrap_timeout: Optional[float] = None):
         logger.info("starting to connect")
-        if polling is True:
+        if self.polling is True:
             self.__fetch_features()
-            self.features_job = self.scheduler.add_job(self.__fetch_features,
-                                                       trigger=IntervalTrigger(seconds=int(15)))
-            self.scheduler.start()
+            self.__poller = PollingThread(self.__fetch_features, self.polling_interval)
+            self.__poller.start()
         else:
+            if bootstrap_timeout is not None:
+                self.__bootstrap(bootstrap_timeout)
             thread = threading.Thread(
-                target=self.__start_stream, args=())
+                target=self.__run_stream, args=())
             thread.daemon = True
             thread.start()
 
-    def is_active(self, key: str, user: Optional[Dict] = None):
-        if self.__initialized is not True:
-            return False
+    @property
+    def is_leader(self) -> bool:
+        """Whether this client holds the upstream connection, always True unless ``shared_snapshot`` is set."""
+        return self.__leader_lock is None or self.__leader_lock.is_leader
+
+    @property
+    def connection_state(self) -> str:
+        """State of the event stream, one of the ``molasses.stream.STATE_*`` values."""
+        return self.__connection_state
+
+    @property
+    def is_ready(self) -> bool:
+        return self.__ready.is_set()
+
+    def wait_until_ready(self, timeout: Optional[float] = None) -> bool:
+        """Blocks until features have been loaded, returning False if ``timeout`` passes first."""
+        return self.__ready.wait(timeout)
 
-        if key in self.__cache:
-            feature = self.__cache[key]
-            result = self.__is_active(feature, user)
-            if user and "id" in user and self.auto_send_events:
-                self.__send_events({
-                    "event": "experiment_started",
-                    "tags": user["params"],
-                    "userId": user["id"],
-                    "featureId": feature["id"],
-                    "featureName": key,
-                    "testType": result if "experiment" else "control"
-                })
+    def on_ready(self, callback: Callable[[], None]):
+        """Calls ``callback`` once features have been loaded, right away if they already are."""
+        with self.__update_lock:
+            if not self.__ready.is_set():
+                self.__ready_callbacks.append(callback)
+                return
+        self.__call_ready_callback(callback)
+
+    def on_change(self, callback: Callable[[List[str]], None]):
+        """Calls ``callback`` with the keys of the features added, updated or removed by each update."""
+        self.__change_callbacks.append(callback)
+
+    @property
+    def snapshot(self) -> FeatureSnapshot:
+        return self.__snapshot
+
+    def membership_index_sizes(self) -> Dict[str, int]:
+        """Approximate bytes used by ``in``/``nin`` value indexes, per feature key."""
+        sizes = {}
+        for key, feature in self.__snapshot.features.items():
+            size = feature_index_size(feature)
+            if size:
+                sizes[key] = size
+        return sizes
+
+    @property
+    def snapshot_age(self) -> Optional[float]:
+        """Seconds since the current features were received, from the network or the snapshot file."""
+        updated_at = self.__snapshot.updated_at
+        if updated_at is None:
+            return None
+        return max(time.time() - updated_at, 0.0)
+
+    def prepare_user(self, user: Dict) -> UserContext:
+        """Normalizes ``user`` once, for passing to ``is_active`` and the event methods for many features."""
+        return UserContext(user)
+
+    def is_active(self, key: str, user: Optional[Dict] = None):
+        feature = self.__snapshot.features.get(key)
+        if feature is not None:
+            instrumentation = self.instrumentation
+            if instrumentation is not None and random() < instrumentation.evaluation_sample_rate:
+                start = time.perf_counter()
+                result = self.__is_active(feature, user)
+                instrumentation.evaluation(key, time.perf_counter() - start)
+            else:
+                result = self.__is_active(feature, user)
+            if user and "id" in user and self.auto_send_events and (
+                    self.exposures is None or self.exposures.should_send(feature.id, user["id"], result)):
+                self.__send_events(experiment_event("experiment_started", key, feature, user, result))
             return result
         else:
             return False
 
+    def evaluate_users(self, key: str, ids, params_columns: Optional[Dict] = None):
+        from .batch import evaluate_users
+        feature = self.__snapshot.features.get(key)
+        return evaluate_users(feature, ids, params_columns)
+
     def experiment_started(self, key: str, user: Optional[Dict] = None, additional_details: Dict = {}):
-        if self.__initialized is not True or user is None or "id" not in user:
+        if user is None or "id" not in user:
             return False
-        if key not in self.__cache:
+        feature = self.__snapshot.features.get(key)
+        if feature is None:
             return False
-        feature = self.__cache[key]
 
         result = self.__is_active(feature, user)
-        self.__send_events({
-            "event": "experiment_started",
-            "tags": {**user["params"], **additional_details},
-            "userId": user["id"],
-            "featureId": feature["id"],
-            "featureName": key,
-            "testType": result if "experiment" else "control"
-        })
+        self.__send_events(experiment_event("experiment_started", key, feature, user, result,
+                                            additional_details))
 
     def track(self, key: str, user: Optional[Dict] = None, additional_details: Dict = {}):
-        tags = additional_details
         if user is None or "id" not in user:
             return False
-        if "params" in user:
-            tags = {**user["params"], **additional_details}
-        self.__send_events({
-            "event": key,
-            "tags": tags,
-            "userId": user["id"]
-        })
+        self.__send_events(track_event(key, user, additional_details))
 
     def experiment_success(self, key: str, user: Optional[Dict] = None, additional_details: Dict = {}):
-        if self.__initialized is not True or user is None or "id" not in user:
+        if user is None or "id" not in user:
             return False
-        if key not in self.__cache:
+        feature = self.__snapshot.features.get(key)
+        if feature is None:
             return False
-        feature = self.__cache[key]
         result = self.__is_active(feature, user)
-        self.__send_events({
-            "event": "experiment_success",
-            "tags": {**user["params"], **additional_details},
-            "userId": user["id"],
-            "featureId": feature["id"],
-            "featureName": key,
-            "testType": result if "experiment" else "control"
-        })
-
-    def stop(self):
-        if self.__polling is True:
-            self.features_job.stop()
-            self.scheduler.shutdown()
-        else:
-            self.__sseclient.close()
+        self.__send_events(experiment_event("experiment_success", key, feature, user, result,
+                                            additional_details))
+
+    def stop(self, timeout=None):
+        if self.__file_watcher is not None:
+            self.__file_watcher.stop(timeout)
+        if self.__follower is not None:
+            self.__follower.stop(timeout)
+        if self.__poller is not None:
+            self.__poller.stop(timeout)
+        self.__stream_stopped.set()
+        if self.__stream_response is not None:
+            self.transport.interrupt(self.__stream_response)
+        self.events.stop(timeout)
+        if self.transport is not None:
+            self.transport.close()
+        if self.__leader_lock is not None:
+            self.__leader_lock.release()
 
     def __is_active(self, feature, user=None):
-        if feature["active"] is not True:
+        if self.result_cache is not None:
+            return self.result_cache.evaluate(feature, user)
+        return is_feature_active(feature, user)
+
+    def __store_features(self, features, source=SOURCE_NETWORK, updated_at: Optional[float] = None):
+        with self.__update_lock:
+            self.__snapshot, changed = updated_snapshot(self.__snapshot, features, source, updated_at)
+            if changed and self.snapshot_path is not None and self.__writes_snapshot:
+                self.__raw_features = {feature["key"]: feature for feature in features}
+                self.__save_snapshot_file()
+            elif source == SOURCE_NETWORK:
+                self.__confirm_shared_snapshot()
+            callbacks = self.__set_ready()
+        if changed:
+            if self.result_cache is not None:
+                self.result_cache.invalidate(changed)
+            for change_callback in self.__change_callbacks:
+                try:
+                    change_callback(changed)
+                except Exception:
+                    logger.error("Molasses on_change callback failed", exc_info=1)
+        for callback in callbacks:
+            self.__call_ready_callback(callback)
+        return changed
+
+    def __refresh_snapshot(self):
+        with self.__update_lock:
+            self.__snapshot = self.__snapshot._replace(updated_at=time.time(), source=SOURCE_NETWORK)
+            self.__confirm_shared_snapshot()
+
+    def __confirm_shared_snapshot(self):
+        """Lets followers know the shared snapshot is still current, at most once per ``shared_snapshot_interval``."""
+        if self.__leader_lock is None or not self.__writes_snapshot:
+            return
+        updated_at = self.__snapshot.updated_at
+        if updated_at is None or updated_at - self.__heartbeat_at < self.__heartbeat_interval:
+            return
+        try:
+            touch_heartbeat(heartbeat_path(self.snapshot_path), updated_at)
+            self.__heartbeat_at = updated_at
+        except OSError:
+            logger.error("Failed to write Molasses heartbeat next to %s", self.snapshot_path, exc_info=1)
+
+    def __set_ready(self):
+        if self.__ready.is_set():
+            return []
+        self.__ready.set()
+        callbacks, self.__ready_callbacks = self.__ready_callbacks, []
+        return callbacks
+
+    def __call_ready_callback(self, callback):
+        try:
+            callback()
+        except Exception:
+            logger.error("Molasses on_ready callback failed", exc_info=1)
+
+    def __load_snapshot_file(self):
+        saved = read_snapshot_file(self.snapshot_path)
+        if saved is None:
+            return
+        saved_at, features = saved
+        self.__snapshot, _ = updated_snapshot(EMPTY_SNAPSHOT, features, SOURCE_DISK, saved_at)
+        self.__raw_features = {feature["key"]: feature for feature in features}
+        self.__set_ready()
+        logger.info("Loaded %s features from %s", len(features), self.snapshot_path)
+
+    def __follow_shared_snapshot(self):
+        if self.__leader_lock.try_acquire():
+            logger.info("Taking over the Molasses connection for this host")
+            self.__writes_snapshot = True
+            self.__follower.stop()
+            self.__connect()
             return False
-        if user is None or "id" not in user:
-            return True
-        segment_map = {}
-        for feature_segment in feature["segments"]:
-            segment_type = feature_segment["segmentType"]
-            segment_map[segment_type] = feature_segment
-        if "alwaysControl" in segment_map and self.__is_user_in_segment(user, segment_map["alwaysControl"]):
+        version = file_version(self.snapshot_path)
+        if version is None or version == self.__shared_version:
+            self.__follow_heartbeat()
             return False
-        if "alwaysExperiment" in segment_map and self.__is_user_in_segment(user, segment_map["alwaysExperiment"]):
-            return True
-        if "everyoneElse" in segment_map:
-            return self.__get_user_percentage(user["id"], segment_map["everyoneElse"]["percentage"])
-        return False
-
-    def __get_user_percentage(self, id="", percentage=0):
-        if percentage == 100:
-            return True
-        if percentage == 0:
+        self.__shared_version = version
+        saved = read_snapshot_file(self.snapshot_path)
+        if saved is None:
             return False
-        c = zlib.crc32(bytes(id, "utf-8")) & 0xffffffff
-        v = abs(c % 100)
-        return v < percentage
-
-    def __is_user_in_segment(self, user: Optional[Dict], s: Dict):
-        user_constraints = s["userConstraints"]
-        constraints_length = len(user_constraints)
-        constraints_to_be_met = 1 if s["constraint"] == "any" else constraints_length
-        constraints_met = 0
-
-        for i in range(constraints_length):
-            constraint = user_constraints[i]
-            param = constraint["userParam"]
-            param_exists = param in user["params"]
-            user_value = None
-            if param_exists:
-                user_value = user["params"][param]
-            if param == "id":
-                param_exists = True
-                user_value = user["id"]
-            if self.__meets_constraint(user_value, param_exists, constraint):
-                constraints_met = constraints_met + 1
-        return constraints_met >= constraints_to_be_met
-
-    def __parse_number(self, user_value):
-        if type(user_value) is (int, float, complex):
-            return user_value
-        elif type(user_value) is bool:
-            return 1 if user_value else 0
-        else:
-            return float(user_value)
+        saved_at, features = saved
+        changed = self.__store_features(features, SOURCE_DISK, saved_at)
+        self.__follow_heartbeat()
+        return len(changed) > 0
 
-    def __parse_bool(self, user_value):
-        if type(user_value) is (int, float, complex):
-            return user_value == 1
-        elif type(user_value) is bool:
-            return user_value
-        else:
-            return user_value == "true"
+    def __follow_heartbeat(self):
+        confirmed_at = heartbeat_time(heartbeat_path(self.snapshot_path))
+        if confirmed_at is None:
+            return
+        with self.__update_lock:
+            snapshot = self.__snapshot
+            if snapshot.version > 0 and (snapshot.updated_at is None or confirmed_at > snapshot.updated_at):
+                self.__snapshot = snapshot._replace(updated_at=confirmed_at)
 
-    def __meets_constraint(self, user_value, param_exists, constraint):
-        operator = constraint["operator"]
-        if param_exists is False:
-            return False
-        constraint_value = constraint["values"]
-        if "userParamType" in constraint and constraint["userParamType"] == "number":
-            user_value = self.__parse_number(user_value)
-            constraint_value = self.__parse_number(constraint_value)
-        elif "userParamType" in constraint and constraint["userParamType"] == "boolean":
-            user_value = self.__parse_bool(user_value)
-            constraint_value = self.__parse_bool(constraint_value)
-        elif "userParamType" in constraint and constraint["userParamType"] == "semver":
-            user_value = str(user_value)
-            user_value = semver.Version.parse(user_value)
-            constraint_value = semver.Version.parse(constraint_value)
-        else:
-            user_value = str(user_value)
-
-        if operator == "in":
-            list_values = constraint_value.split(",")
-            return user_value in list_values
-        elif operator == "nin":
-            list_values = constraint_value.split(",")
-            return user_value not in list_values
-        elif operator == "equals":
-            return user_value == constraint_value
-        elif operator == "doesNotEqual":
-            return user_value != constraint_value
-        elif operator == "gt":
-            return user_value > constraint_value
-        elif operator == "gte":
-            return user_value >= constraint_value
-        elif operator == "lt":
-            return user_value < constraint_value
-        elif operator == "lte":
-            return user_value <= constraint_value
-        elif operator == "contains":
-            return user_value in constraint_value
-        elif operator == "doesNotContain":
-            return user_value not in constraint_value
-        else:
+    def __load_features_file(self):
+        from .offline import read_features_file
+        features = read_features_file(self.features_file)
+        if features is None:
             return False
+        return len(self.__store_features(features, SOURCE_DISK)) > 0
+
+    def __save_snapshot_file(self):
+        try:
+            save_snapshot_file(self.snapshot_path, self.__raw_features.values())
+        except OSError:
+            logger.error("Failed to write Molasses snapshot to %s", self.snapshot_path, exc_info=1)
 
     def __send_events(self, event_options: Dict):
-        event_options["tags"] = json.dumps(event_options["tags"])
-        requests.post(self.base_url + "/analytics", json=event_options, headers={
-            "Authorization": "Bearer " + self.api_key
-        })
-
-    def __schedule_reconnect(self):
-        scheduled_time = 1 * self.__retry_count * 2
-        if scheduled_time == 0:
-            scheduled_time = 1
-        elif scheduled_time >= 64:
-            scheduled_time = 64
-        scheduled_time = scheduled_time - \
-            math.trunc(random() * 0.3 * scheduled_time)
-        self.__retry_count = self.__retry_count + 1
-        logger.info(
-            "Scheduling reconnect to Molasses in {scheduled_time} Seconds".format(scheduled_time=scheduled_time))
-        time.sleep(scheduled_time)
-        self.__start_stream()
-
-    def __start_stream(self):
+        if self.event_limiter is not None:
+            event_options = self.event_limiter.admit(event_options)
+            if event_options is None:
+                return
+        self.events.put(event_options)
+
+    def __post_events(self, events: List[Dict]):
+        for event_options in events:
+            event_options["tags"] = json.dumps(event_options["tags"])
+        start = time.perf_counter()
+        ok = False
         try:
-            response = requests.get(self.base_url + "/event-stream", params={}, stream=True, headers={
-                "Authorization": "Bearer " + self.api_key
-            })
+            response = self.transport.post("/analytics", json=events)
             response.raise_for_status()
-            client = sseclient.SSEClient(response)
-            for event in client.events():
-                data = json.loads(event.data)
-                if "data" in data:
-                    d = data.get("data")
-                    if "features" in d:
-                        features = d.get("features")
-                        for feature in features:
-                            self.__cache[feature["key"]] = feature
-                            self.__initialized = True
-                            logger.info("Initiated and connected")
-        except requests.ConnectionError:
-            logger.error("Failed to connect with Molasses")
-            self.__schedule_reconnect()
-        except Exception:
-            logger.error("Connection lost with Molasses")
-            self.__schedule_reconnect()
+            ok = True
+        finally:
+            if self.instrumentation is not None:
+                self.instrumentation.events_sent(len(events), time.perf_counter() - start, ok)
+
+    def __set_connection_state(self, state: str):
+        self.__connection_state = state
+        if self.instrumentation is not None:
+            self.instrumentation.stream_state(state)
 
-    def __fetch_features(self):
-        response = requests.get(self.base_url + "/features", params={}, headers={
-            "Authorization": "Bearer " + self.api_key
-        })
+    def __run_stream(self):
+        import sseclient
+        while not self.__stream_stopped.is_set():
+            self.__set_connection_state(STATE_CONNECTING)
+            try:
+                self.__read_stream(sseclient)
+                error = "Connection lost with Molasses"
+            except requests.ConnectionError:
+                error = "Failed to connect with Molasses"
+            except Exception:
+                error = "Connection lost with Molasses"
+            if self.__stream_stopped.is_set():
+                break
+            logger.error(error)
+            scheduled_time = self.reconnect_backoff.next()
+            self.reconnect_count += 1
+            self.__set_connection_state(STATE_BACKOFF)
+            if self.instrumentation is not None:
+                self.instrumentation.reconnect(self.reconnect_backoff.attempts, scheduled_time)
+            logger.info("Scheduling reconnect to Molasses in {scheduled_time:.1f} Seconds".format(
+                scheduled_time=scheduled_time))
+            self.__stream_stopped.wait(scheduled_time)
+        self.__set_connection_state(STATE_STOPPED)
+
+    def __read_stream(self, sseclient):
+        headers = {"Last-Event-ID": self.__last_event_id} if self.__last_event_id else None
+        with self.transport.stream("/event-stream", headers=headers) as response:
+            response.raise_for_status()
+            self.__stream_response = response
+            if not self.__stream_stopped.is_set():
+                self.__read_events(sseclient, response)
+
+    def __read_events(self, sseclient, response):
+        # Chunked streams can be read a chunk at a time; otherwise reads must stay small
+        # so that they do not wait for bytes of the next event.
+        chunked = getattr(response.raw, "chunked", False)
+        client = sseclient.SSEClient(response.iter_content(chunk_size=None) if chunked else response)
+        self.__set_connection_state(STATE_CONNECTED)
+        self.reconnect_backoff.connected()
+        last_data = None
+        for event in client.events():
+            if event.id:
+                self.__last_event_id = event.id
+            if event.data == last_data:
+                self.__refresh_snapshot()
+                continue
+            last_data = event.data
+            data = json.loads(event.data)
+            if "data" in data:
+                d = data.get("data")
+                if "features" in d:
+                    self.__store_features(d.get("features"))
+                    logger.info("Initiated and connected")
+
+    def __bootstrap(self, timeout: float):
+        """Fetches the features once, without retries, giving up after ``timeout`` seconds."""
+        deadline = time.monotonic() + timeout
+        fetch = threading.Thread(target=self.__fetch_features, args=(timeout, deadline),
+                                 name="molasses-bootstrap")
+        fetch.daemon = True
+        fetch.start()
+        fetch.join(timeout)
+
+    def __fetch_features(self, timeout: Optional[float] = None, deadline: Optional[float] = None):
+        headers = {"If-None-Match": self.__etag} if self.__etag else None
+        start = time.perf_counter()
+        try:
+            response = self.transport.get("/features", headers=headers, timeout=timeout,
+                                          retry=deadline is None)
+        except requests.RequestException:
+            self.__record_fetch(None, start)
+            logger.error("Failed to fetch features from Molasses", exc_info=1)
+            return False
+        self.__record_fetch(response.status_code, start, len(response.content))
+        if deadline is not None and time.monotonic() > deadline:
+            return False
+        if response.status_code == 304:
+            self.__refresh_snapshot()
+            return False
         if response.status_code == 200:
             data = response.json()
             if "data" in data:
                 d = data.get("data")
                 if "features" in d:
-                    features = d.get("features")
-                    for feature in features:
-                        self.__cache[feature["key"]] = feature
-                    self.__initialized = True
+                    changed = self.__store_features(d.get("features"))
+                    self.__etag = response.headers.get("ETag")
+                    return len(changed) > 0
         else:
             logger.error("Molasses - %s %s",
                          response.status_code, response.text, exc_info=1)
+        return False
+
+    def __record_fetch(self, status: Optional[int], start: float, size=0):
+        if self.instrumentation is not None:
+            self.instrumentation.fetch(status, time.perf_counter() - start, size)
@@ -0,0 +1,382 @@
+"""asyncio client for ASGI services.
+
+Requires aiohttp, which is installed with ``pip install molasses[async]``.
+"""
+
+import asyncio
+import concurrent.futures
+import json
+import logging
+import math
+import threading
+from random import random
+from typing import Awaitable, Callable, Dict, List, Optional
+
+import aiohttp
+
+from .evaluation import is_feature_active
+from .events import (OVERFLOW_BLOCK, OVERFLOW_DROP, EventLimiter, ExposureFilter, experiment_event,
+                     track_event)
+from .snapshot import EMPTY_SNAPSHOT, FeatureSnapshot, updated_snapshot
+from .transport import BASE_URL
+from .user import UserContext
+
+logger = logging.getLogger(__name__)
+
+
+async def iter_sse_data(content):
+    """Yields the ``data`` of every server sent event read from ``content``."""
+    data = []
+    async for raw_line in content:
+        line = raw_line.decode("utf-8").rstrip("\r\n")
+        if not line:
+            if data:
+                yield "\n".join(data)
+                data = []
+            continue
+        if line.startswith(":"):
+            continue
+        field, _, value = line.partition(":")
+        if field == "data":
+            data.append(value[1:] if value.startswith(" ") else value)
+
+
+class AsyncEventQueue:
+    """
+    The asyncio counterpart of :class:`~molasses.events.EventQueue`.
+
+    One task drains the queue and awaits ``send`` with batches of at most
+    ``batch_size`` events, once a batch is full or ``linger`` seconds after
+    its first event. ``put`` never waits: when ``max_size`` events are
+    queued it drops the event. With ``overflow="block"``, ``put_wait``
+    waits for room instead.
+    """
+
+    def __init__(self, send: Callable[[List[Dict]], Awaitable[None]], max_size=10000, batch_size=100,
+                 linger=1.0, overflow=OVERFLOW_DROP):
+        if overflow not in (OVERFLOW_DROP, OVERFLOW_BLOCK):
+            raise ValueError("overflow must be 'drop' or 'block'")
+        self.send = send
+        self.max_size = max_size
+        self.batch_size = batch_size
+        self.linger = linger
+        self.overflow = overflow
+        self.enqueued = 0
+        self.dropped = 0
+        self.sent = 0
+        self.failed = 0
+        self.__queue = None
+        self.__batch_ready = None
+        self.__flushing = 0
+        self.__worker = None
+        self.__closed = False
+
+    @property
+    def depth(self):
+        return self.__queue.qsize() if self.__queue is not None else 0
+
+    def stats(self):
+        return {
+            "enqueued": self.enqueued,
+            "dropped": self.dropped,
+            "sent": self.sent,
+            "failed": self.failed,
+            "depth": self.depth,
+        }
+
+    def put(self, event: Dict) -> bool:
+        if self.__closed:
+            self.dropped += 1
+            return False
+        self.__start()
+        try:
+            self.__queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self.dropped += 1
+            return False
+        self.__enqueued()
+        return True
+
+    async def put_wait(self, event: Dict) -> bool:
+        """Like ``put``, but waits for room when the queue is full and ``overflow`` is ``"block"``."""
+        if self.overflow != OVERFLOW_BLOCK or self.__closed:
+            return self.put(event)
+        self.__start()
+        await self.__queue.put(event)
+        self.__enqueued()
+        return True
+
+    async def flush(self, timeout: Optional[float] = None) -> bool:
+        """Waits until every queued event has been handed to ``send``, at most ``timeout`` seconds."""
+        if self.__worker is None:
+            return True
+        self.__flushing += 1
+        self.__batch_ready.set()
+        try:
+            await asyncio.wait_for(self.__queue.join(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            self.__flushing -= 1
+
+    async def stop(self, timeout: Optional[float] = None):
+        """Sends what is queued, waiting at most ``timeout`` seconds, then stops the worker task."""
+        if self.__closed:
+            return
+        self.__closed = True
+        if self.__worker is None:
+            return
+        await self.flush(timeout)
+        self.__worker.cancel()
+        try:
+            await self.__worker
+        except asyncio.CancelledError:
+            pass
+
+    def __start(self):
+        if self.__worker is None:
+            self.__queue = asyncio.Queue(self.max_size)
+            self.__batch_ready = asyncio.Event()
+            self.__worker = asyncio.ensure_future(self.__run())
+
+    def __enqueued(self):
+        self.enqueued += 1
+        if self.__queue.qsize() >= self.batch_size - 1:
+            self.__batch_ready.set()
+
+    async def __run(self):
+        queue = self.__queue
+        while True:
+            batch = [await queue.get()]
+            if not self.__flushing and queue.qsize() < self.batch_size - 1:
+                self.__batch_ready.clear()
+                try:
+                    await asyncio.wait_for(self.__batch_ready.wait(), self.linger)
+                except asyncio.TimeoutError:
+                    pass
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(queue.get_nowait())
+                except asyncio.QueueEmpty:
+                    break
+            try:
+                await self.send(batch)
+                self.sent += len(batch)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                self.failed += len(batch)
+                logger.error("Molasses - failed to send %s analytics events", len(batch), exc_info=1)
+            finally:
+                for _ in batch:
+                    queue.task_done()
+
+
+class AsyncMolassesClient:
+    """
+    Molasses client that runs on the asyncio event loop.
+
+    Call ``await client.start()`` (or use it as an async context manager) to
+    begin streaming or polling features. ``is_active`` is synchronous and never
+    blocks. ``track``, ``experiment_started`` and ``experiment_success``
+    queue their event and return an awaitable that resolves once it is
+    queued; a single task sends queued events in batches, like the
+    threaded client's :class:`~molasses.events.EventQueue`. Called from
+    another thread, such as the threadpool sync endpoints run in, they hand
+    the event to the event loop and return a ``concurrent.futures.Future``.
+    """
+
+    def __init__(self, api_key: str, auto_send_events=False, polling=False, base_url=BASE_URL,
+                 polling_interval=15, connect_timeout=5.0, read_timeout=30.0,
+                 stream_idle_timeout: Optional[float] = 90.0,
+                 session: Optional[aiohttp.ClientSession] = None,
+                 exposure_window: Optional[float] = None, exposure_cache_size=100000,
+                 events_sample_rates: Optional[Dict[str, float]] = None,
+                 events_rate_limit: Optional[float] = None, events_burst: Optional[float] = None,
+                 events_batch_size=100, events_linger=1.0, events_queue_size=10000,
+                 events_overflow=OVERFLOW_DROP):
+        self.api_key = api_key
+        self.auto_send_events = auto_send_events
+        self.polling = polling
+        self.base_url = base_url
+        self.polling_interval = polling_interval
+        self.timeout = aiohttp.ClientTimeout(sock_connect=connect_timeout, sock_read=read_timeout)
+        self.stream_timeout = aiohttp.ClientTimeout(sock_connect=connect_timeout, sock_read=stream_idle_timeout)
+        self.__headers = {"Authorization": "Bearer " + api_key}
+        self.__session = session
+        self.__owns_session = session is None
+        self.__snapshot = EMPTY_SNAPSHOT
+        self.__retry_count = 0
+        self.__task = None
+        self.__loop = None
+        self.__loop_thread = None
+        self.events = AsyncEventQueue(self.__post_events, max_size=events_queue_size,
+                                      batch_size=events_batch_size, linger=events_linger,
+                                      overflow=events_overflow)
+        self.exposures = None
+        if exposure_window is not None:
+            self.exposures = ExposureFilter(exposure_window, exposure_cache_size)
+        self.event_limiter = None
+        if events_sample_rates or events_rate_limit is not None:
+            self.event_limiter = EventLimiter(events_sample_rates, rate_limit=events_rate_limit,
+                                              burst=events_burst)
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.stop()
+
+    async def start(self):
+        self.__loop = asyncio.get_event_loop()
+        self.__loop_thread = threading.get_ident()
+        if self.__session is None:
+            self.__session = aiohttp.ClientSession()
+        if self.polling is True:
+            await self.__fetch_features()
+            self.__task = asyncio.ensure_future(self.__poll())
+        else:
+            self.__task = asyncio.ensure_future(self.__stream())
+
+    async def stop(self):
+        if self.__task is not None:
+            self.__task.cancel()
+            try:
+                await self.__task
+            except asyncio.CancelledError:
+                pass
+            self.__task = None
+        await self.events.stop(self.timeout.sock_read)
+        if self.__owns_session and self.__session is not None:
+            await self.__session.close()
+            self.__session = None
+
+    @property
+    def snapshot(self) -> FeatureSnapshot:
+        return self.__snapshot
+
+    def prepare_user(self, user: Dict) -> UserContext:
+        """Normalizes ``user`` once, for passing to ``is_active`` and the event methods for many features."""
+        return UserContext(user)
+
+    def is_active(self, key: str, user: Optional[Dict] = None):
+        feature = self.__snapshot.features.get(key)
+        if feature is None:
+            return False
+        result = is_feature_active(feature, user)
+        if user and "id" in user and self.auto_send_events and (
+                self.exposures is None or self.exposures.should_send(feature.id, user["id"], result)):
+            self.__send_events(experiment_event("experiment_started", key, feature, user, result), wait=False)
+        return result
+
+    def experiment_started(self, key: str, user: Optional[Dict] = None, additional_details: Dict = {}):
+        return self.__send_experiment_event("experiment_started", key, user, additional_details)
+
+    def experiment_success(self, key: str, user: Optional[Dict] = None, additional_details: Dict = {}):
+        return self.__send_experiment_event("experiment_success", key, user, additional_details)
+
+    def track(self, key: str, user: Optional[Dict] = None, additional_details: Dict = {}):
+        if user is None or "id" not in user:
+            return self.__completed(False)
+        return self.__send_events(track_event(key, user, additional_details))
+
+    def __send_experiment_event(self, event: str, key: str, user: Optional[Dict], additional_details: Dict):
+        if user is None or "id" not in user:
+            return self.__completed(False)
+        feature = self.__snapshot.features.get(key)
+        if feature is None:
+            return self.__completed(False)
+        result = is_feature_active(feature, user)
+        return self.__send_events(experiment_event(event, key, feature, user, result, additional_details))
+
+    def __send_events(self, event_options: Dict, wait=True):
+        if self.event_limiter is not None:
+            event_options = self.event_limiter.admit(event_options)
+            if event_options is None:
+                return self.__completed(False)
+        if self.__off_loop():
+            queued = concurrent.futures.Future()
+            self.__loop.call_soon_threadsafe(self.__put_from_thread, event_options, queued)
+            return queued
+        if wait and self.events.overflow == OVERFLOW_BLOCK and self.events.depth >= self.events.max_size:
+            return asyncio.ensure_future(self.events.put_wait(event_options))
+        return self.__completed(self.events.put(event_options))
+
+    def __off_loop(self):
+        return self.__loop is not None and threading.get_ident() != self.__loop_thread
+
+    def __completed(self, result: bool):
+        """An already resolved future of the kind the calling thread can wait on."""
+        if self.__off_loop():
+            done = concurrent.futures.Future()
+        else:
+            done = asyncio.get_event_loop().create_future()
+        done.set_result(result)
+        return done
+
+    def __put_from_thread(self, event_options: Dict, queued: concurrent.futures.Future):
+        queued.set_result(self.events.put(event_options))
+
+    async def __post_events(self, events: List[Dict]):
+        for event_options in events:
+            event_options["tags"] = json.dumps(event_options["tags"])
+        async with self.__session.post(self.base_url + "/analytics", json=events, headers=self.__headers,
+                                       timeout=self.timeout) as response:
+            response.raise_for_status()
+
+    def __store_features(self, features):
+        self.__snapshot, _ = updated_snapshot(self.__snapshot, features)
+
+    async def __fetch_features(self):
+        try:
+            async with self.__session.get(self.base_url + "/features", headers=self.__headers,
+                                          timeout=self.timeout) as response:
+                if response.status != 200:
+                    logger.error("Molasses - %s %s", response.status, await response.text())
+                    return
+                data = await response.json()
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            logger.error("Failed to fetch features from Molasses", exc_info=1)
+            return
+        d = data.get("data", {})
+        if "features" in d:
+            self.__store_features(d["features"])
+
+    async def __poll(self):
+        while True:
+            await asyncio.sleep(self.polling_interval)
+            await self.__fetch_features()
+
+    async def __stream(self):
+        while True:
+            try:
+                async with self.__session.get(self.base_url + "/event-stream", headers=self.__headers,
+                                              timeout=self.stream_timeout) as response:
+                    response.raise_for_status()
+                    async for event_data in iter_sse_data(response.content):
+                        data = json.loads(event_data)
+                        d = data.get("data", {})
+                        if "features" in d:
+                            self.__store_features(d["features"])
+                            self.__retry_count = 0
+                            logger.info("Initiated and connected")
+                logger.error("Connection lost with Molasses")
+            except asyncio.CancelledError:
+                raise
+            except asyncio.TimeoutError:
+                logger.error("Molasses event stream was idle for %s seconds", self.stream_timeout.sock_read)
+            except aiohttp.ClientError:
+                logger.error("Failed to connect with Molasses")
+            except Exception:
+                logger.error("Connection lost with Molasses")
+            await asyncio.sleep(self.__reconnect_delay())
+
+    def __reconnect_delay(self):
+        scheduled_time = min(max(self.__retry_count * 2, 1), 64)
+        scheduled_time = scheduled_time - math.trunc(random() * 0.3 * scheduled_time)
+        self.__retry_count = self.__retry_count + 1
+        logger.info(
+            "Scheduling reconnect to Molasses in {scheduled_time} Seconds".format(scheduled_time=scheduled_time))
+        return scheduled_time
@@ -0,0 +1,96 @@
+"""Columnar evaluation of a single feature across many users.
+
+Requires numpy, which is installed with ``pip install molasses[numpy]``.
+"""
+
+import zlib
+from typing import Dict, Optional, Sequence
+
+import numpy as np
+
+from .evaluation import (Feature, Segment, parse_bool,
+                         parse_number, _contains, _does_not_contain, _never)
+from .membership import is_index
+
+
+def crc32_buckets(ids: Sequence[str]):
+    """Returns ``zlib.crc32(id) % 100`` for every id, as an array."""
+    return np.fromiter((zlib.crc32(bytes(id, "utf-8")) % 100 for id in ids),
+                       dtype=np.uint32, count=len(ids))
+
+
+def _test_values(constraint, values):
+    test = constraint.test
+    coerce = constraint.coerce
+    if test is _never:
+        return False
+    if coerce is str:
+        user_values = np.array([str(v) for v in values], dtype=str)
+        if is_index(constraint.value):
+            mask = np.isin(user_values, list(constraint.value))
+            return mask if test is _contains else ~mask
+        if test is _contains or test is _does_not_contain:
+            mask = np.char.find(constraint.value, user_values) >= 0
+            return mask if test is _contains else ~mask
+        return test(user_values, constraint.value)
+    if coerce is parse_number:
+        return test(np.array([parse_number(v) for v in values], dtype=float), constraint.value)
+    if coerce is parse_bool:
+        return test(np.array([parse_bool(v) for v in values], dtype=bool), constraint.value)
+    return np.fromiter((test(coerce(v), constraint.value) for v in values),
+                       dtype=bool, count=len(values))
+
+
+def _constraint_mask(constraint, ids, params_columns, n):
+    mask = np.zeros(n, dtype=bool)
+    if constraint.param == "id":
+        values = ids
+        present = np.ones(n, dtype=bool)
+    else:
+        if constraint.param not in params_columns:
+            return mask
+        values = np.asarray(params_columns[constraint.param], dtype=object)
+        present = np.fromiter((v is not None for v in values), dtype=bool, count=n)
+    if present.any():
+        mask[present] = _test_values(constraint, values[present])
+    return mask
+
+
+def _segment_mask(segment: Segment, ids, params_columns, n):
+    if segment.match_all:
+        mask = np.ones(n, dtype=bool)
+        for constraint in segment.constraints:
+            mask &= _constraint_mask(constraint, ids, params_columns, n)
+    else:
+        mask = np.zeros(n, dtype=bool)
+        for constraint in segment.constraints:
+            mask |= _constraint_mask(constraint, ids, params_columns, n)
+    return mask
+
+
+def evaluate_users(feature: Optional[Feature], ids: Sequence[str],
+                   params_columns: Optional[Dict[str, Sequence]] = None):
+    """Evaluates ``feature`` for every user id in ``ids``.
+
+    ``params_columns`` maps a user param name to a column aligned with
+    ``ids``; ``None`` entries mean the param is not set for that user.
+    Returns a boolean array matching ``is_active`` for each user.
+    """
+    ids = np.asarray(ids, dtype=object)
+    n = len(ids)
+    if feature is None or not feature.active or n == 0:
+        return np.zeros(n, dtype=bool)
+    params_columns = params_columns or {}
+
+    if feature.percentage is None or feature.percentage == 0:
+        result = np.zeros(n, dtype=bool)
+    elif feature.percentage == 100:
+        result = np.ones(n, dtype=bool)
+    else:
+        result = crc32_buckets(ids) < feature.percentage
+
+    if feature.always_experiment is not None:
+        result |= _segment_mask(feature.always_experiment, ids, params_columns, n)
+    if feature.always_control is not None:
+        result &= ~_segment_mask(feature.always_control, ids, params_columns, n)
+    return result
@@ -0,0 +1,245 @@
+"""
+Evaluates features for a large file of users across all cores.
+
+Run it as::
+
+    python -m molasses.bulk --features-file features.json users.csv -o assignments.csv
+    python -m molasses.bulk --api-key $MOLASSES_API_KEY --feature FOO_TEST users.jsonl
+
+Features come from a file shaped like the ``/features`` response or are
+fetched from the API. Users are read as a stream, from CSV with an ``id``
+column and one column per param or from JSON lines like
+``{"id": "foo", "params": {...}}``, and handed to a pool of processes in
+chunks. Each worker evaluates every user for every feature exactly as
+``MolassesClient.is_active`` does and writes one row per assignment, so
+memory stays flat however large the input is. Progress and the final
+rows per second are reported on stderr.
+"""
+
+import argparse
+import csv
+import io
+import json
+import multiprocessing
+import os
+import sys
+import time
+from collections import deque
+from typing import Dict, Iterator, List, Optional, TextIO
+
+from .evaluation import is_feature_active
+from .offline import read_features_file
+from .snapshot import EMPTY_SNAPSHOT, updated_snapshot
+from .transport import BASE_URL, Transport
+from .user import UserContext
+
+FORMATS = ("csv", "jsonl")
+OUTPUT_COLUMNS = ("user_id", "feature", "active")
+
+_worker = None
+
+
+def fetch_features(api_key: str, base_url=BASE_URL) -> List[Dict]:
+    """Fetches the current features from the ``/features`` endpoint."""
+    transport = Transport(api_key, base_url)
+    try:
+        response = transport.get("/features")
+        response.raise_for_status()
+        return response.json()["data"]["features"]
+    finally:
+        transport.close()
+
+
+def guess_format(path: str, default="csv") -> str:
+    extension = os.path.splitext(path)[1].lstrip(".").lower()
+    if extension in ("json", "jsonl", "ndjson"):
+        return "jsonl"
+    return extension if extension in FORMATS else default
+
+
+class Evaluator:
+    """Turns a chunk of input records into the rendered assignment rows for ``keys``."""
+
+    def __init__(self, features: List[Dict], keys: List[str], input_format="csv",
+                 output_format="csv", header: Optional[List[str]] = None, id_column="id"):
+        snapshot, _ = updated_snapshot(EMPTY_SNAPSHOT, features)
+        self.features = [(key, snapshot.features[key]) for key in keys]
+        self.input_format = input_format
+        self.output_format = output_format
+        self.header = header
+        self.id_column = id_column
+
+    def users(self, records) -> Iterator[Dict]:
+        if self.input_format == "jsonl":
+            for line in records:
+                if line.strip():
+                    yield json.loads(line)
+            return
+        header = self.header
+        id_column = self.id_column
+        for row in records:
+            params = {name: value for name, value in zip(header, row) if value != ""}
+            user_id = params.pop(id_column, None)
+            yield {"params": params} if user_id is None else {"id": user_id, "params": params}
+
+    def evaluate(self, records):
+        """Returns ``(text, users, rows)`` for a chunk of CSV rows or JSON lines."""
+        out = io.StringIO()
+        write_csv = csv.writer(out, lineterminator="\n").writerow if self.output_format == "csv" else None
+        users = 0
+        for user in self.users(records):
+            context = UserContext(user)
+            users += 1
+            for key, feature in self.features:
+                active = is_feature_active(feature, context)
+                if write_csv is not None:
+                    write_csv((context.id, key, "true" if active else "false"))
+                else:
+                    out.write(json.dumps({"userId": context.id, "feature": key, "active": active}) + "\n")
+        return out.getvalue(), users, users * len(self.features)
+
+
+def _init_worker(*args):
+    global _worker
+    _worker = Evaluator(*args)
+
+
+def _evaluate_chunk(records):
+    return _worker.evaluate(records)
+
+
+def _chunks(records, size):
+    chunk = []
+    for record in records:
+        chunk.append(record)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def run(features: List[Dict], users: TextIO, out: TextIO, keys: Optional[List[str]] = None,
+        input_format="csv", output_format="csv", id_column="id", workers: Optional[int] = None,
+        chunk_size=5000, progress_interval: Optional[float] = None, progress: TextIO = sys.stderr) -> Dict:
+    """
+    Writes an assignment row to ``out`` for every user read from ``users``
+    and every feature in ``keys`` (all features when None), in input order.
+
+    ``workers`` processes evaluate ``chunk_size`` users at a time, with at
+    most two chunks per worker in flight; with one worker everything runs in
+    this process. Returns the counts and rate of the run.
+    """
+    if input_format not in FORMATS or output_format not in FORMATS:
+        raise ValueError("formats must be one of %s" % ", ".join(FORMATS))
+    known = [feature["key"] for feature in features]
+    keys = sorted(known) if keys is None else list(keys)
+    missing = set(keys) - set(known)
+    if missing:
+        raise ValueError("unknown features: %s" % ", ".join(sorted(missing)))
+
+    header = None
+    records = users
+    if input_format == "csv":
+        records = csv.reader(users)
+        header = next(records, None) or []
+        if id_column not in header:
+            raise ValueError("the users CSV has no %r column" % id_column)
+    if output_format == "csv":
+        out.write(",".join(OUTPUT_COLUMNS) + "\n")
+
+    workers = workers or os.cpu_count() or 1
+    init_args = (features, keys, input_format, output_format, header, id_column)
+    stats = {"users": 0, "rows": 0, "seconds": 0.0, "rows_per_second": 0.0, "workers": workers}
+    start = time.perf_counter()
+    reported = [start]
+
+    def write(result):
+        text, user_count, row_count = result
+        out.write(text)
+        stats["users"] += user_count
+        stats["rows"] += row_count
+        now = time.perf_counter()
+        if progress_interval is not None and now - reported[0] >= progress_interval:
+            reported[0] = now
+            print("%d users, %d rows, %.0f rows/s" % (
+                stats["users"], stats["rows"], stats["rows"] / (now - start)), file=progress)
+
+    chunks = _chunks(records, chunk_size)
+    if workers == 1:
+        evaluator = Evaluator(*init_args)
+        for chunk in chunks:
+            write(evaluator.evaluate(chunk))
+    else:
+        with multiprocessing.Pool(workers, _init_worker, init_args) as pool:
+            pending = deque()
+            for chunk in chunks:
+                pending.append(pool.apply_async(_evaluate_chunk, (chunk,)))
+                if len(pending) >= workers * 2:
+                    write(pending.popleft().get())
+            while pending:
+                write(pending.popleft().get())
+
+    stats["seconds"] = time.perf_counter() - start
+    if stats["seconds"]:
+        stats["rows_per_second"] = stats["rows"] / stats["seconds"]
+    return stats
+
+
+def _open(path, mode):
+    if path == "-":
+        return sys.stdin if "r" in mode else sys.stdout
+    return open(path, mode, newline="")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m molasses.bulk",
+                                     description=__doc__.strip().splitlines()[0])
+    parser.add_argument("users", help="CSV or JSON lines file of users, - for stdin")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--features-file", help="features in the shape of the /features response")
+    source.add_argument("--api-key", help="fetch the features from Molasses with this API key")
+    parser.add_argument("--base-url", default=BASE_URL, help="Molasses API base URL")
+    parser.add_argument("--feature", action="append", dest="keys",
+                        help="feature key to evaluate, may be repeated; default all features")
+    parser.add_argument("--output", "-o", default="-", help="file to write assignments to, - for stdout")
+    parser.add_argument("--input-format", choices=FORMATS, help="default from the users file extension")
+    parser.add_argument("--output-format", choices=FORMATS, help="default from the output file extension")
+    parser.add_argument("--id-column", default="id", help="CSV column holding the user id")
+    parser.add_argument("--workers", type=int, help="processes to evaluate with; default one per core")
+    parser.add_argument("--chunk-size", type=int, default=5000, help="users per unit of work")
+    parser.add_argument("--progress-interval", type=float, default=10.0,
+                        help="seconds between progress reports on stderr")
+    args = parser.parse_args(argv)
+
+    if args.features_file is not None:
+        features = read_features_file(args.features_file)
+        if features is None:
+            parser.error("could not read features from %s" % args.features_file)
+    else:
+        features = fetch_features(args.api_key, args.base_url)
+    input_format = args.input_format or guess_format(args.users)
+    output_format = args.output_format or guess_format(args.output)
+
+    users = _open(args.users, "r")
+    out = _open(args.output, "w")
+    try:
+        stats = run(features, users, out, args.keys, input_format, output_format, args.id_column,
+                    args.workers, args.chunk_size, args.progress_interval)
+    except ValueError as e:
+        parser.error(str(e))
+    finally:
+        if users is not sys.stdin:
+            users.close()
+        if out is not sys.stdout:
+            out.close()
+        else:
+            out.flush()
+    print("%d users, %d rows in %.1fs, %.0f rows/s with %d workers" % (
+        stats["users"], stats["rows"], stats["seconds"], stats["rows_per_second"], stats["workers"]),
+        file=sys.stderr)
+    return stats
+
+
+if __name__ == "__main__":
+    main()
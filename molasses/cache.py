@@ -0,0 +1,110 @@
+"""Bounded LRU cache of evaluation results."""
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, Optional
+
+from .evaluation import Feature, is_feature_active
+from .metrics import ShardedCounter
+
+_MISSING = object()
+
+
+class ResultCache:
+    """
+    Memoizes ``is_feature_active`` per feature revision and user.
+
+    Entries are keyed by the feature key and version, the user id and the
+    values of the params the feature reads, so users that differ only in
+    params the feature ignores share an entry. At most ``maxsize`` entries
+    are kept, each for at most ``ttl`` seconds when ``ttl`` is set.
+
+    Entries are spread over ``segments`` independently locked LRU segments
+    by the hash of their key, so threads rarely wait on each other; by
+    default there is one segment per thousand entries, up to 16. Each
+    segment also indexes its entries by feature key, so ``invalidate`` only
+    touches the entries of the features that changed.
+    """
+
+    def __init__(self, maxsize=10000, ttl: Optional[float] = None, segments: Optional[int] = None):
+        if segments is None:
+            segments = max(1, min(16, maxsize // 1000))
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.__segment_size = max(1, maxsize // segments)
+        self.__segments = [(OrderedDict(), {}, threading.Lock()) for _ in range(segments)]
+        self.__hits = ShardedCounter()
+        self.__misses = ShardedCounter()
+
+    @property
+    def hits(self):
+        return self.__hits.value
+
+    @property
+    def misses(self):
+        return self.__misses.value
+
+    def __len__(self):
+        return sum(len(entries) for entries, _, _ in self.__segments)
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "size": len(self)}
+
+    def evaluate(self, feature: Feature, user: Optional[Dict] = None):
+        if user is None or "id" not in user:
+            return is_feature_active(feature, user)
+        try:
+            key = self.__key(feature, user)
+            hash(key)
+        except (KeyError, TypeError):
+            return is_feature_active(feature, user)
+
+        entries, by_feature, lock = self.__segments[hash(key) % len(self.__segments)]
+        now = time.monotonic()
+        with lock:
+            entry = entries.get(key)
+            if entry is not None and (entry[1] is None or entry[1] > now):
+                entries.move_to_end(key)
+                self.__hits.add()
+                return entry[0]
+        self.__misses.add()
+
+        result = is_feature_active(feature, user)
+        expires = now + self.ttl if self.ttl is not None else None
+        with lock:
+            if key in entries:
+                entries.move_to_end(key)
+            else:
+                by_feature.setdefault(feature.key, set()).add(key)
+            entries[key] = (result, expires)
+            while len(entries) > self.__segment_size:
+                evicted, _ = entries.popitem(last=False)
+                keys = by_feature[evicted[0]]
+                keys.discard(evicted)
+                if not keys:
+                    del by_feature[evicted[0]]
+        return result
+
+    def invalidate(self, feature_keys: Iterable[str]):
+        """Drops every entry of the given features."""
+        feature_keys = set(feature_keys)
+        for entries, by_feature, lock in self.__segments:
+            with lock:
+                for feature_key in feature_keys:
+                    for key in by_feature.pop(feature_key, ()):
+                        del entries[key]
+
+    def clear(self):
+        for entries, by_feature, lock in self.__segments:
+            with lock:
+                entries.clear()
+                by_feature.clear()
+
+    def __key(self, feature: Feature, user: Dict):
+        if feature.params:
+            params = user["params"]
+            values = tuple((type(v), v) for v in (params.get(p, _MISSING) for p in feature.params))
+        else:
+            values = ()
+        return (feature.key, feature.version, user["id"], values)
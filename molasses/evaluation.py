@@ -0,0 +1,302 @@
+"""Compiles feature definitions into evaluation plans and evaluates them."""
+
+import functools
+import hashlib
+import json
+import operator
+import sys
+import zlib
+from typing import Dict, Optional, Tuple
+
+from .membership import build_index, index_size, is_index
+from .user import MISSING, UNSET, UserContext
+
+
+class Constraint:
+    """
+    A user constraint compiled for evaluation.
+
+    ``test(coerce(user_value), value)`` decides whether the user param
+    named ``param`` meets it; ``value`` is parsed or indexed ahead of time.
+    """
+
+    __slots__ = ("param", "coerce", "test", "value", "typed_key")
+
+    def __init__(self, param: str, coerce, test, value):
+        self.param = sys.intern(param)
+        self.coerce = coerce
+        self.test = test
+        self.value = value
+        self.typed_key = (self.param, coerce)
+
+    def __repr__(self):
+        return "Constraint(%r, %s, %r)" % (self.param, self.test.__name__, self.value)
+
+
+class Segment:
+    """A segment's constraints, which must all match when ``match_all`` is set and any otherwise."""
+
+    __slots__ = ("match_all", "constraints")
+
+    def __init__(self, match_all: bool, constraints: Tuple[Constraint, ...]):
+        self.match_all = match_all
+        self.constraints = constraints
+
+    def __repr__(self):
+        return "Segment(match_all=%r, constraints=%r)" % (self.match_all, self.constraints)
+
+
+class Feature:
+    """
+    A feature compiled from its wire JSON, keeping only what evaluation reads.
+
+    ``version`` identifies the feature's content and ``params`` lists the
+    user params, other than ``id``, that its constraints read.
+    """
+
+    __slots__ = ("id", "key", "active", "always_control", "always_experiment", "percentage",
+                 "version", "params")
+
+    def __init__(self, id, key: str, active: bool, always_control: Optional[Segment],
+                 always_experiment: Optional[Segment], percentage, version: str,
+                 params: Tuple[str, ...]):
+        self.id = id
+        self.key = sys.intern(key)
+        self.active = active
+        self.always_control = always_control
+        self.always_experiment = always_experiment
+        self.percentage = percentage
+        self.version = version
+        self.params = params
+
+    def __repr__(self):
+        return "Feature(key=%r, active=%r, version=%r)" % (self.key, self.active, self.version)
+
+
+def parse_number(value):
+    if type(value) is bool:
+        return 1 if value else 0
+    return float(value)
+
+
+def parse_bool(value):
+    if type(value) is bool:
+        return value
+    return value == "true"
+
+
+@functools.lru_cache(maxsize=1024)
+def semver_key(value: str):
+    """Returns a tuple that orders like semver precedence, or None if ``value`` is not a version."""
+    import semver
+    try:
+        version = semver.Version.parse(value)
+    except (TypeError, ValueError):
+        return None
+    if not version.prerelease:
+        return (version.major, version.minor, version.patch, (1,))
+    identifiers = tuple((0, int(part), "") if part.isdigit() else (1, 0, part)
+                        for part in version.prerelease.split("."))
+    return (version.major, version.minor, version.patch, (0, identifiers))
+
+
+def parse_semver(value):
+    return semver_key(str(value))
+
+
+def _semver_test(test):
+    def semver_test(user_value, constraint_value):
+        return user_value is not None and test(user_value, constraint_value)
+    return semver_test
+
+
+def _never(user_value, constraint_value):
+    return False
+
+
+def _contains(user_value, constraint_value):
+    return user_value in constraint_value
+
+
+def _does_not_contain(user_value, constraint_value):
+    return user_value not in constraint_value
+
+
+ORDERING_OPERATORS = {
+    "equals": operator.eq,
+    "doesNotEqual": operator.ne,
+    "gt": operator.gt,
+    "gte": operator.ge,
+    "lt": operator.lt,
+    "lte": operator.le,
+}
+
+MEMBERSHIP_OPERATORS = {
+    "in": _contains,
+    "nin": _does_not_contain,
+    "contains": _contains,
+    "doesNotContain": _does_not_contain,
+}
+
+COERCIONS = {
+    "number": parse_number,
+    "boolean": parse_bool,
+    "semver": parse_semver,
+}
+
+
+def compile_constraint(constraint: Dict):
+    param_type = constraint.get("userParamType")
+    op = constraint["operator"]
+    coerce = COERCIONS.get(param_type, str)
+    value = constraint["values"]
+    try:
+        if param_type in COERCIONS:
+            value = coerce(value)
+    except (TypeError, ValueError):
+        value = None
+    if value is None:
+        return Constraint(constraint["userParam"], coerce, _never, None)
+
+    if op in ORDERING_OPERATORS:
+        test = ORDERING_OPERATORS[op]
+        if coerce is str and op not in ("equals", "doesNotEqual") and not isinstance(value, str):
+            test = _never
+        elif coerce is parse_semver:
+            test = _semver_test(test)
+    elif op in MEMBERSHIP_OPERATORS and coerce is str and isinstance(value, str):
+        test = MEMBERSHIP_OPERATORS[op]
+        if op in ("in", "nin"):
+            value = build_index(value)
+    else:
+        test = _never
+    return Constraint(constraint["userParam"], coerce, test, value)
+
+
+def compile_segment(segment: Dict):
+    return Segment(
+        segment["constraint"] != "any",
+        tuple(compile_constraint(c) for c in segment["userConstraints"]))
+
+
+def compile_feature(feature: Dict, version: Optional[str] = None):
+    segments = {}
+    for feature_segment in feature["segments"]:
+        segments[feature_segment["segmentType"]] = feature_segment
+    always_control = None
+    always_experiment = None
+    percentage = None
+    if "alwaysControl" in segments:
+        always_control = compile_segment(segments["alwaysControl"])
+    if "alwaysExperiment" in segments:
+        always_experiment = compile_segment(segments["alwaysExperiment"])
+    if "everyoneElse" in segments:
+        percentage = segments["everyoneElse"]["percentage"]
+    params = set()
+    for segment in (always_control, always_experiment):
+        if segment is not None:
+            params.update(c.param for c in segment.constraints if c.param != "id")
+    return Feature(
+        feature.get("id"),
+        feature["key"],
+        feature["active"] is True,
+        always_control,
+        always_experiment,
+        percentage,
+        version or feature_version(feature),
+        tuple(sorted(params)))
+
+
+def feature_version(feature: Dict):
+    """Returns a hash of the feature's content, used to tell feature revisions apart."""
+    encoded = json.dumps(feature, separators=(",", ":"), default=str)
+    return hashlib.sha1(encoded.encode("utf-8")).hexdigest()
+
+
+def feature_index_size(feature: Feature):
+    """Approximate bytes used by the ``in``/``nin`` indexes of ``feature``."""
+    size = 0
+    for segment in (feature.always_control, feature.always_experiment):
+        if segment is not None:
+            size += sum(index_size(c.value) for c in segment.constraints if is_index(c.value))
+    return size
+
+
+def get_user_percentage(id="", percentage=0):
+    if percentage == 100:
+        return True
+    if percentage == 0:
+        return False
+    c = zlib.crc32(bytes(id, "utf-8")) & 0xffffffff
+    v = abs(c % 100)
+    return v < percentage
+
+
+def meets_constraint(constraint: Constraint, user: Dict):
+    param = constraint.param
+    if param == "id":
+        user_value = user["id"]
+    else:
+        params = user["params"]
+        if param not in params:
+            return False
+        user_value = params[param]
+    return constraint.test(constraint.coerce(user_value), constraint.value)
+
+
+def is_user_in_segment(user: Dict, segment: Segment):
+    if segment.match_all:
+        for constraint in segment.constraints:
+            if not meets_constraint(constraint, user):
+                return False
+        return True
+    for constraint in segment.constraints:
+        if meets_constraint(constraint, user):
+            return True
+    return False
+
+
+def is_context_in_segment(context: UserContext, segment: Segment):
+    typed_values = context.typed_values
+    match_all = segment.match_all
+    for constraint in segment.constraints:
+        user_value = typed_values.get(constraint.typed_key, UNSET)
+        if user_value is UNSET:
+            user_value = context.typed(constraint.param, constraint.coerce)
+        met = user_value is not MISSING and constraint.test(user_value, constraint.value)
+        if met is not match_all:
+            return met
+    return match_all
+
+
+def is_feature_active_for_context(feature: Feature, context: UserContext):
+    if not feature.active:
+        return False
+    if context.id is None:
+        return True
+    if feature.always_control is not None and is_context_in_segment(context, feature.always_control):
+        return False
+    if feature.always_experiment is not None and is_context_in_segment(context, feature.always_experiment):
+        return True
+    percentage = feature.percentage
+    if percentage is not None:
+        if percentage == 100:
+            return True
+        return percentage != 0 and context.bucket < percentage
+    return False
+
+
+def is_feature_active(feature: Feature, user: Optional[Dict] = None):
+    if type(user) is UserContext:
+        return is_feature_active_for_context(feature, user)
+    if not feature.active:
+        return False
+    if user is None or "id" not in user:
+        return True
+    if feature.always_control is not None and is_user_in_segment(user, feature.always_control):
+        return False
+    if feature.always_experiment is not None and is_user_in_segment(user, feature.always_experiment):
+        return True
+    if feature.percentage is not None:
+        return get_user_percentage(user["id"], feature.percentage)
+    return False
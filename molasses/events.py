@@ -0,0 +1,318 @@
+"""Bounded, non-blocking analytics queue drained by a background worker."""
+
+import logging
+import queue
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional
+
+from .metrics import ShardedCounter
+
+logger = logging.getLogger(__name__)
+
+OVERFLOW_DROP = "drop"
+OVERFLOW_BLOCK = "block"
+
+_STOP = object()
+
+
+def experiment_event(event: str, key: str, feature, user: Dict, result, additional_details: Dict = {}):
+    return {
+        "event": event,
+        "tags": {**user["params"], **additional_details},
+        "userId": user["id"],
+        "featureId": feature.id,
+        "featureName": key,
+        "testType": result if "experiment" else "control"
+    }
+
+
+def track_event(key: str, user: Dict, additional_details: Dict = {}):
+    tags = additional_details
+    if "params" in user:
+        tags = {**user["params"], **additional_details}
+    return {
+        "event": key,
+        "tags": tags,
+        "userId": user["id"]
+    }
+
+
+def sample_bucket(user_id: str) -> float:
+    """Places ``user_id`` in [0, 1), the same way every time and independently of percentage roll outs."""
+    return (zlib.crc32(b"molasses-sample:" + bytes(user_id, "utf-8")) & 0xffffffff) / 4294967296.0
+
+
+class TokenBucket:
+    """Allows ``rate`` acquisitions per second on average and bursts of up to ``burst``."""
+
+    def __init__(self, rate: float, burst: Optional[float] = None):
+        self.rate = rate
+        self.burst = burst if burst is not None else max(rate, 1.0)
+        self.__tokens = self.burst
+        self.__updated = time.monotonic()
+        self.__lock = threading.Lock()
+
+    def try_acquire(self) -> bool:
+        with self.__lock:
+            now = time.monotonic()
+            self.__tokens = min(self.burst, self.__tokens + (now - self.__updated) * self.rate)
+            self.__updated = now
+            if self.__tokens < 1:
+                return False
+            self.__tokens -= 1
+            return True
+
+
+class EventLimiter:
+    """
+    Samples analytics events and limits their rate before they are queued.
+
+    ``sample_rates`` maps event names to the fraction of users whose events
+    are kept, ``default_sample_rate`` applies to other names. A user is
+    either always or never sampled for a given rate, so experiment groups
+    stay unbiased, and kept events record the rate in their ``sampleRate``
+    tag for re-weighting. ``rate_limit`` caps the events per second that
+    get through, in bursts of up to ``burst``.
+    """
+
+    def __init__(self, sample_rates: Optional[Dict[str, float]] = None, default_sample_rate=1.0,
+                 rate_limit: Optional[float] = None, burst: Optional[float] = None):
+        self.sample_rates = dict(sample_rates or {})
+        self.default_sample_rate = default_sample_rate
+        self.bucket = TokenBucket(rate_limit, burst) if rate_limit is not None else None
+        self.__sampled_out = ShardedCounter()
+        self.__rate_limited = ShardedCounter()
+
+    @property
+    def sampled_out(self):
+        return self.__sampled_out.value
+
+    @property
+    def rate_limited(self):
+        return self.__rate_limited.value
+
+    def stats(self):
+        return {"sampled_out": self.sampled_out, "rate_limited": self.rate_limited}
+
+    def admit(self, event: Dict) -> Optional[Dict]:
+        """Returns the event to queue, with its sample rate tagged, or None to drop it."""
+        rate = self.sample_rates.get(event["event"], self.default_sample_rate)
+        if rate < 1.0:
+            if sample_bucket(str(event["userId"])) >= rate:
+                self.__sampled_out.add()
+                return None
+            event["tags"] = dict(event["tags"], sampleRate=rate)
+        if self.bucket is not None and not self.bucket.try_acquire():
+            self.__rate_limited.add()
+            return None
+        return event
+
+
+class ExposureFilter:
+    """
+    Lets each (feature, user, variant) exposure through once per ``window`` seconds.
+
+    Exposures are remembered in insertion order, which is also expiry order,
+    so expired ones are dropped from the front as new ones arrive. At most
+    ``max_size`` are remembered; forgetting one early only lets a duplicate
+    through. ``suppressed`` counts the exposures that were filtered out.
+    Like :class:`~molasses.cache.ResultCache`, exposures are spread over
+    independently locked segments by hash once ``max_size`` is large.
+    """
+
+    def __init__(self, window=3600.0, max_size=100000, segments: Optional[int] = None):
+        if segments is None:
+            segments = max(1, min(16, max_size // 1000))
+        self.window = window
+        self.max_size = max_size
+        self.__segment_size = max(1, max_size // segments)
+        self.__segments = [(OrderedDict(), threading.Lock()) for _ in range(segments)]
+        self.__suppressed = ShardedCounter()
+
+    @property
+    def suppressed(self):
+        return self.__suppressed.value
+
+    def __len__(self):
+        return sum(len(seen) for seen, _ in self.__segments)
+
+    def stats(self):
+        return {"suppressed": self.suppressed, "size": len(self)}
+
+    def should_send(self, feature_id, user_id, variant) -> bool:
+        key = (feature_id, user_id, variant)
+        now = time.monotonic()
+        seen, lock = self.__segments[hash(key) % len(self.__segments)]
+        with lock:
+            expires = seen.get(key)
+            if expires is not None and expires > now:
+                self.__suppressed.add()
+                return False
+            if expires is not None:
+                del seen[key]
+            seen[key] = now + self.window
+            while seen:
+                oldest, oldest_expires = next(iter(seen.items()))
+                if oldest_expires > now and len(seen) <= self.__segment_size:
+                    break
+                del seen[oldest]
+        return True
+
+
+class EventQueue:
+    """
+    Queues analytics events and sends them in batches from a worker thread.
+
+    ``send`` is called with a list of at most ``batch_size`` events, once the
+    batch is full or ``linger`` seconds after its first event. When the queue
+    holds ``max_size`` events, ``overflow`` decides whether new events are
+    dropped or the caller blocks until there is room. ``put`` takes no lock
+    of its own beyond the queue's, and its counters are sharded per thread.
+    """
+
+    def __init__(self, send: Callable[[List[Dict]], None], max_size=10000, batch_size=100,
+                 linger=1.0, overflow=OVERFLOW_DROP):
+        if overflow not in (OVERFLOW_DROP, OVERFLOW_BLOCK):
+            raise ValueError("overflow must be 'drop' or 'block'")
+        self.send = send
+        self.batch_size = batch_size
+        self.linger = linger
+        self.overflow = overflow
+        self.sent = 0
+        self.failed = 0
+        self.__enqueued = ShardedCounter()
+        self.__dropped = ShardedCounter()
+        self.__queue = queue.Queue(max_size)
+        self.__lock = threading.Lock()
+        self.__worker = None
+        self.__closed = False
+
+    @property
+    def enqueued(self):
+        return self.__enqueued.value
+
+    @property
+    def dropped(self):
+        return self.__dropped.value
+
+    @property
+    def depth(self):
+        return self.__queue.qsize()
+
+    def stats(self):
+        return {
+            "enqueued": self.enqueued,
+            "dropped": self.dropped,
+            "sent": self.sent,
+            "failed": self.failed,
+            "depth": self.depth,
+        }
+
+    def put(self, event: Dict):
+        if self.__closed:
+            self.__dropped.add()
+            return False
+        if self.__worker is None:
+            self.__start_worker()
+        try:
+            self.__queue.put(event, block=self.overflow == OVERFLOW_BLOCK)
+        except queue.Full:
+            self.__dropped.add()
+            return False
+        self.__enqueued.add()
+        return True
+
+    def flush(self, timeout=None):
+        """Waits until every event queued before the call has been handed to ``send``."""
+        worker = self.__worker
+        if worker is None:
+            return True
+        if not worker.is_alive():
+            return self.depth == 0
+        flushed = threading.Event()
+        try:
+            self.__queue.put(flushed, timeout=timeout)
+        except queue.Full:
+            return False
+        return flushed.wait(timeout)
+
+    def stop(self, timeout=None):
+        """Sends what is queued, then stops the worker thread, waiting at most ``timeout`` seconds in all."""
+        if self.__closed:
+            return
+        self.__closed = True
+        with self.__lock:
+            worker = self.__worker
+        if worker is not None:
+            deadline = None if timeout is None else time.monotonic() + timeout
+            try:
+                self.__queue.put(_STOP, timeout=timeout)
+            except queue.Full:
+                logger.error("Molasses - gave up sending %s queued analytics events", self.depth)
+                return
+            worker.join(None if deadline is None else max(deadline - time.monotonic(), 0))
+
+    def __start_worker(self):
+        with self.__lock:
+            if self.__worker is None:
+                worker = threading.Thread(target=self.__run, name="molasses-events")
+                worker.daemon = True
+                worker.start()
+                self.__worker = worker
+
+    def __run(self):
+        stopping = False
+        while not stopping:
+            item = self.__queue.get()
+            if item is _STOP:
+                break
+            if isinstance(item, threading.Event):
+                item.set()
+                continue
+            batch = [item]
+            flushed = []
+            deadline = time.monotonic() + self.linger
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                try:
+                    if remaining > 0:
+                        item = self.__queue.get(timeout=remaining)
+                    else:
+                        item = self.__queue.get_nowait()
+                except queue.Empty:
+                    break
+                if isinstance(item, threading.Event):
+                    flushed.append(item)
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+            if stopping:
+                batch.extend(self.__drain(flushed))
+            for start in range(0, len(batch), self.batch_size):
+                self.__send(batch[start:start + self.batch_size])
+            for event in flushed:
+                event.set()
+
+    def __drain(self, flushed):
+        while True:
+            try:
+                item = self.__queue.get_nowait()
+            except queue.Empty:
+                return
+            if isinstance(item, threading.Event):
+                flushed.append(item)
+            elif item is not _STOP:
+                yield item
+
+    def __send(self, batch):
+        try:
+            self.send(batch)
+            self.sent += len(batch)
+        except Exception:
+            self.failed += len(batch)
+            logger.error("Molasses - failed to send %s analytics events", len(batch), exc_info=1)
@@ -0,0 +1,53 @@
+"""Indexes for the value lists of ``in`` and ``nin`` constraints."""
+
+import sys
+from bisect import bisect_left
+from typing import Iterable
+
+SORTED_INDEX_THRESHOLD = 5000
+
+
+class SortedIndex:
+    """
+    Membership test over a sorted tuple of strings using binary search.
+
+    Stores one pointer per value instead of a hash table, which for large
+    allowlists takes a fraction of a frozenset's memory at O(log n) lookups.
+    """
+
+    __slots__ = ("values",)
+
+    def __init__(self, values: Iterable[str]):
+        self.values = tuple(sorted(set(values)))
+
+    def __contains__(self, value):
+        values = self.values
+        i = bisect_left(values, value)
+        return i != len(values) and values[i] == value
+
+    def __iter__(self):
+        return iter(self.values)
+
+    def __len__(self):
+        return len(self.values)
+
+
+def build_index(values: str, threshold=SORTED_INDEX_THRESHOLD):
+    """Indexes a comma separated value list, as a frozenset unless it is longer than ``threshold``."""
+    split = values.split(",")
+    if len(split) > threshold:
+        return SortedIndex(split)
+    return frozenset(split)
+
+
+def is_index(value):
+    return isinstance(value, (frozenset, SortedIndex))
+
+
+def index_size(index):
+    """Approximate memory used by ``index``, in bytes, including the strings it holds."""
+    if isinstance(index, SortedIndex):
+        container = sys.getsizeof(index) + sys.getsizeof(index.values)
+    else:
+        container = sys.getsizeof(index)
+    return container + sum(sys.getsizeof(value) for value in index)
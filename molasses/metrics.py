@@ -0,0 +1,258 @@
+"""Instrumentation hooks and a Prometheus text exporter."""
+
+import threading
+import weakref
+from bisect import bisect_left
+from typing import Dict, Optional
+
+from .stream import STATE_CONNECTED, STATES
+
+EVALUATION_BUCKETS = (1e-6, 2.5e-6, 5e-6, 1e-5, 2.5e-5, 5e-5, 1e-4, 2.5e-4, 1e-3, 1e-2)
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class _Owner:
+    """Lives in a thread's local storage so that its finalizer runs when the thread exits."""
+
+    __slots__ = ("__weakref__",)
+
+
+def _fold(counter_ref, cell):
+    counter = counter_ref()
+    if counter is not None:
+        counter._fold(cell)
+
+
+class ShardedCounter:
+    """
+    A counter that many threads can increment without contending.
+
+    Each thread adds to a cell of its own and reads sum the cells, so no
+    increment is lost even without the GIL, and hot paths share no lock.
+    When a thread exits its cell is folded into a base total, so threads
+    that come and go do not make the counter grow.
+    """
+
+    def __init__(self):
+        self.__local = threading.local()
+        self.__cells = {}
+        self.__base = 0
+        self.__lock = threading.Lock()
+
+    def add(self, amount=1):
+        try:
+            cell = self.__local.cell
+        except AttributeError:
+            cell = self.__new_cell()
+        cell[0] += amount
+
+    @property
+    def value(self) -> int:
+        with self.__lock:
+            return self.__base + sum(cell[0] for cell in self.__cells.values())
+
+    @property
+    def cells(self) -> int:
+        """Cells of threads that are still running."""
+        with self.__lock:
+            return len(self.__cells)
+
+    def _fold(self, cell):
+        with self.__lock:
+            if self.__cells.pop(id(cell), None) is not None:
+                self.__base += cell[0]
+
+    def __new_cell(self):
+        cell = [0]
+        owner = _Owner()
+        weakref.finalize(owner, _fold, weakref.ref(self), cell)
+        with self.__lock:
+            self.__cells[id(cell)] = cell
+        self.__local.owner = owner
+        self.__local.cell = cell
+        return cell
+
+
+class Histogram:
+    """Counts observations into buckets with the upper bounds ``buckets``."""
+
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets=DURATION_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Instrumentation:
+    """
+    Hooks the client calls as it works; every hook does nothing here.
+
+    Subclass it to forward measurements to your own metrics system and pass
+    an instance as ``MolassesClient(instrumentation=...)``. Only an
+    ``evaluation_sample_rate`` fraction of ``is_active`` calls is timed, so
+    with the default of 0 evaluations cost one comparison more.
+    """
+
+    evaluation_sample_rate = 0.0
+
+    def evaluation(self, key: str, seconds: float):
+        """A sampled ``is_active`` call for feature ``key`` took ``seconds``."""
+
+    def fetch(self, status: Optional[int], seconds: float, size: int):
+        """A ``/features`` request finished; ``status`` is None when it failed without a response."""
+
+    def stream_state(self, state: str):
+        """The event stream moved to ``state``, one of the ``molasses.stream.STATE_*`` values."""
+
+    def reconnect(self, attempts: int, delay: float):
+        """The event stream will reconnect in ``delay`` seconds, the ``attempts``-th retry in a row."""
+
+    def events_sent(self, count: int, seconds: float, ok: bool):
+        """A batch of ``count`` analytics events was posted, successfully or not."""
+
+
+class MetricsRecorder(Instrumentation):
+    """Aggregates what the hooks report into counters and histograms for :func:`render_prometheus`."""
+
+    def __init__(self, evaluation_sample_rate=0.01):
+        self.evaluation_sample_rate = evaluation_sample_rate
+        self.evaluations = {}  # type: Dict[str, Histogram]
+        self.fetches = {}  # type: Dict[str, int]
+        self.fetch_duration = Histogram()
+        self.fetch_bytes = 0
+        self.last_fetch_bytes = 0
+        self.events_send_duration = Histogram()
+        self.__lock = threading.Lock()
+
+    def evaluation(self, key, seconds):
+        with self.__lock:
+            histogram = self.evaluations.get(key)
+            if histogram is None:
+                histogram = self.evaluations[key] = Histogram(EVALUATION_BUCKETS)
+            histogram.observe(seconds)
+
+    def fetch(self, status, seconds, size):
+        status = "error" if status is None else str(status)
+        with self.__lock:
+            self.fetches[status] = self.fetches.get(status, 0) + 1
+            self.fetch_duration.observe(seconds)
+            self.fetch_bytes += size
+            if size:
+                self.last_fetch_bytes = size
+
+    def events_sent(self, count, seconds, ok):
+        with self.__lock:
+            self.events_send_duration.observe(seconds)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(labels: Dict) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join('%s="%s"' % (name, _escape(value)) for name, value in sorted(labels.items())) + "}"
+
+
+def _format(value) -> str:
+    if isinstance(value, bool):
+        return "1" if value else "0"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Writer:
+    def __init__(self, namespace):
+        self.namespace = namespace
+        self.lines = []
+
+    def metric(self, name, kind, help_text, samples):
+        name = self.namespace + "_" + name
+        self.lines.append("# HELP %s %s" % (name, help_text))
+        self.lines.append("# TYPE %s %s" % (name, kind))
+        for labels, value in samples:
+            self.lines.append("%s%s %s" % (name, _labels(labels), _format(value)))
+
+    def histogram(self, name, help_text, histograms):
+        name = self.namespace + "_" + name
+        self.lines.append("# HELP %s %s" % (name, help_text))
+        self.lines.append("# TYPE %s histogram" % name)
+        for labels, histogram in histograms:
+            cumulative = 0
+            for bound, count in zip(histogram.buckets + ("+Inf",), histogram.counts):
+                cumulative += count
+                bucket_labels = dict(labels, le=bound if bound == "+Inf" else repr(float(bound)))
+                self.lines.append("%s_bucket%s %d" % (name, _labels(bucket_labels), cumulative))
+            self.lines.append("%s_sum%s %s" % (name, _labels(labels), _format(histogram.sum)))
+            self.lines.append("%s_count%s %d" % (name, _labels(labels), histogram.count))
+
+
+def render_prometheus(client, namespace="molasses") -> str:
+    """
+    Renders the state of ``client`` in the Prometheus text exposition format.
+
+    Snapshot, stream, result cache and analytics queue metrics are always
+    included; histograms are added when the client's instrumentation is a
+    :class:`MetricsRecorder`.
+    """
+    out = _Writer(namespace)
+    snapshot = client.snapshot
+    out.metric("ready", "gauge", "Whether features have been loaded.", [({}, client.is_ready)])
+    out.metric("snapshot_version", "gauge", "Version of the current feature snapshot.",
+               [({}, snapshot.version)])
+    out.metric("snapshot_features", "gauge", "Features in the current snapshot.",
+               [({}, len(snapshot.features))])
+    age = client.snapshot_age
+    if age is not None:
+        out.metric("snapshot_age_seconds", "gauge", "Seconds since the features were last received.",
+                   [({}, age)])
+    if not client.polling:
+        out.metric("stream_connected", "gauge", "Whether the event stream is connected.",
+                   [({}, client.connection_state == STATE_CONNECTED)])
+        out.metric("stream_state", "gauge", "Current state of the event stream.",
+                   [({"state": state}, client.connection_state == state) for state in STATES])
+        out.metric("stream_reconnects_total", "counter", "Reconnects to the event stream.",
+                   [({}, client.reconnect_count)])
+        out.metric("stream_backoff_seconds", "gauge", "Delay picked for the last reconnect.",
+                   [({}, client.reconnect_backoff.delay)])
+    if client.result_cache is not None:
+        stats = client.result_cache.stats()
+        out.metric("result_cache_hits_total", "counter", "Result cache hits.", [({}, stats["hits"])])
+        out.metric("result_cache_misses_total", "counter", "Result cache misses.", [({}, stats["misses"])])
+        out.metric("result_cache_size", "gauge", "Entries in the result cache.", [({}, stats["size"])])
+    if client.exposures is not None:
+        out.metric("exposures_suppressed_total", "counter", "Repeated exposures that were not sent.",
+                   [({}, client.exposures.suppressed)])
+    if client.event_limiter is not None:
+        limiter = client.event_limiter.stats()
+        out.metric("events_limited_total", "counter", "Analytics events dropped before queueing.",
+                   [({"reason": reason}, limiter[reason]) for reason in ("sampled_out", "rate_limited")])
+    stats = client.events.stats()
+    out.metric("events_total", "counter", "Analytics events by outcome.",
+               [({"outcome": outcome}, stats[outcome]) for outcome in ("enqueued", "dropped", "sent", "failed")])
+    out.metric("events_queue_depth", "gauge", "Analytics events waiting to be sent.", [({}, stats["depth"])])
+
+    recorder = client.instrumentation
+    if isinstance(recorder, MetricsRecorder):
+        out.metric("evaluation_sample_rate", "gauge", "Fraction of evaluations that are timed.",
+                   [({}, recorder.evaluation_sample_rate)])
+        out.histogram("evaluation_seconds", "Sampled is_active latency per feature.",
+                      [({"feature": key}, histogram) for key, histogram in sorted(recorder.evaluations.items())])
+        out.metric("fetches_total", "counter", "Feature fetches by HTTP status.",
+                   [({"status": status}, count) for status, count in sorted(recorder.fetches.items())])
+        out.histogram("fetch_duration_seconds", "Duration of feature fetches.",
+                      [({}, recorder.fetch_duration)])
+        out.metric("fetch_bytes_total", "counter", "Bytes of feature payloads fetched.",
+                   [({}, recorder.fetch_bytes)])
+        out.metric("fetch_last_bytes", "gauge", "Size of the last feature payload fetched.",
+                   [({}, recorder.last_fetch_bytes)])
+        out.histogram("events_send_duration_seconds", "Duration of analytics batch posts.",
+                      [({}, recorder.events_send_duration)])
+    return "\n".join(out.lines) + "\n"
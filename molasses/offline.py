@@ -0,0 +1,152 @@
+"""Running without the network: features from a local file, analytics to a local file."""
+
+import ctypes
+import ctypes.util
+import json
+import logging
+import os
+import select
+import struct
+import sys
+import threading
+from typing import Callable, Dict, List, Optional
+
+from .polling import AdaptiveInterval, PollingThread
+from .shared import file_version
+
+logger = logging.getLogger(__name__)
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_CLOEXEC = 0o2000000
+_EVENT_HEADER = struct.Struct("iIII")
+
+
+def read_features_file(path: str) -> Optional[List[Dict]]:
+    """Reads features from a file shaped like the ``/features`` response, None if it is unusable."""
+    try:
+        with open(path, "rb") as f:
+            data = json.loads(f.read())
+        return data["data"]["features"]
+    except (OSError, ValueError, KeyError, TypeError):
+        logger.error("Molasses - could not read features from %s", path, exc_info=1)
+        return None
+
+
+def _load_inotify():
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        libc.inotify_init1.argtypes = [ctypes.c_int]
+        libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        return libc
+    except (OSError, AttributeError):
+        return None
+
+
+class FileWatcher:
+    """
+    Calls ``on_change`` from a background thread whenever the file at ``path``
+    is rewritten or replaced.
+
+    Uses inotify on the file's directory where it is available, so that
+    atomic replacements are seen too, and otherwise checks the file's
+    mtime, size and inode every ``interval`` seconds.
+    """
+
+    def __init__(self, path: str, on_change: Callable[[], None], interval=1.0):
+        self.path = path
+        self.on_change = on_change
+        self.interval = interval
+        self.uses_inotify = False
+        self.__version = file_version(path)
+        self.__poller = None
+        self.__thread = None
+        self.__wake = None
+
+    def start(self):
+        inotify_fd = self.__inotify_fd()
+        if inotify_fd is None:
+            self.__poller = PollingThread(self.__poll, AdaptiveInterval(self.interval, self.interval, jitter=0))
+            self.__poller.start()
+            return
+        self.uses_inotify = True
+        self.__wake = os.pipe()
+        self.__thread = threading.Thread(target=self.__watch, args=(inotify_fd,), name="molasses-file-watcher")
+        self.__thread.daemon = True
+        self.__thread.start()
+
+    def stop(self, timeout=None):
+        if self.__poller is not None:
+            self.__poller.stop(timeout)
+        if self.__thread is not None:
+            thread, self.__thread = self.__thread, None
+            os.write(self.__wake[1], b"x")
+            thread.join(timeout)
+
+    def __inotify_fd(self):
+        libc = _load_inotify()
+        if libc is None:
+            return None
+        fd = libc.inotify_init1(IN_CLOEXEC)
+        if fd < 0:
+            return None
+        directory = os.path.dirname(os.path.abspath(self.path))
+        if libc.inotify_add_watch(fd, os.fsencode(directory), IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE) < 0:
+            os.close(fd)
+            return None
+        return fd
+
+    def __poll(self):
+        version = file_version(self.path)
+        if version is None or version == self.__version:
+            return False
+        self.__version = version
+        self.on_change()
+        return True
+
+    def __watch(self, inotify_fd):
+        name = os.fsencode(os.path.basename(self.path))
+        wake = self.__wake[0]
+        try:
+            while True:
+                readable, _, _ = select.select([inotify_fd, wake], [], [])
+                if wake in readable:
+                    return
+                buffer = os.read(inotify_fd, 65536)
+                offset = 0
+                touched = False
+                while offset < len(buffer):
+                    _, _, _, length = _EVENT_HEADER.unpack_from(buffer, offset)
+                    offset += _EVENT_HEADER.size
+                    touched = touched or buffer[offset:offset + length].rstrip(b"\0") == name
+                    offset += length
+                if touched:
+                    try:
+                        self.__poll()
+                    except Exception:
+                        logger.error("Molasses - reloading %s failed", self.path, exc_info=1)
+        finally:
+            os.close(inotify_fd)
+            os.close(self.__wake[0])
+            os.close(self.__wake[1])
+
+
+def discard_events(events: List[Dict]):
+    """Event sink for offline clients without an ``events_file``: analytics go nowhere."""
+
+
+class JsonlEventSink:
+    """Appends analytics events to ``path``, one JSON object per line, in place of sending them."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.__lock = threading.Lock()
+
+    def send(self, events: List[Dict]):
+        lines = "".join(json.dumps(event, default=str) + "\n" for event in events)
+        with self.__lock:
+            with open(self.path, "a") as f:
+                f.write(lines)
@@ -0,0 +1,67 @@
+"""Adaptive interval and timer thread for polling mode."""
+
+import logging
+import threading
+from random import random
+from typing import Callable
+
+logger = logging.getLogger(__name__)
+
+
+class AdaptiveInterval:
+    """
+    Picks the delay before the next poll.
+
+    After a poll that found changes the delay drops back to ``min_interval``;
+    after each poll that found none it grows by ``backoff`` up to
+    ``max_interval``. Every delay is spread by up to ``jitter`` (a fraction)
+    in either direction so a fleet of clients does not poll in lockstep.
+    """
+
+    def __init__(self, min_interval=15.0, max_interval=60.0, backoff=1.5, jitter=0.1):
+        if max_interval < min_interval:
+            raise ValueError("max_interval must be at least min_interval")
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.jitter = jitter
+        self.current = min_interval
+
+    def next(self, changed: bool) -> float:
+        if changed:
+            self.current = self.min_interval
+        else:
+            self.current = min(self.current * self.backoff, self.max_interval)
+        return self.current * (1 + self.jitter * (2 * random() - 1))
+
+
+class PollingThread:
+    """
+    Daemon thread that calls ``poll`` repeatedly, waiting the delay picked by
+    ``interval`` in between. ``poll`` returns whether anything changed.
+    """
+
+    def __init__(self, poll: Callable[[], bool], interval: AdaptiveInterval):
+        self.poll = poll
+        self.interval = interval
+        self.__stopped = threading.Event()
+        self.__thread = threading.Thread(target=self.__run, name="molasses-polling")
+        self.__thread.daemon = True
+
+    def start(self):
+        self.__thread.start()
+
+    def stop(self, timeout=None):
+        self.__stopped.set()
+        if self.__thread.is_alive() and self.__thread is not threading.current_thread():
+            self.__thread.join(timeout)
+
+    def __run(self):
+        delay = self.interval.next(True)
+        while not self.__stopped.wait(delay):
+            try:
+                changed = self.poll()
+            except Exception:
+                logger.error("Molasses - polling for features failed", exc_info=1)
+                changed = False
+            delay = self.interval.next(changed)
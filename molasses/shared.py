@@ -0,0 +1,78 @@
+"""Host-wide sharing of one upstream connection between worker processes."""
+
+import logging
+import os
+from typing import Optional
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - Windows
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+
+class LeaderLock:
+    """
+    Elects one process per host with an exclusive ``flock`` on ``path``.
+
+    The process holding the lock keeps the upstream connection and
+    publishes features to the shared snapshot file; the lock is released
+    when the process exits, letting another one take over. Where ``flock``
+    is unavailable every process becomes a leader.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.is_leader = False
+        self.__file = None
+
+    def try_acquire(self) -> bool:
+        if self.is_leader:
+            return True
+        if fcntl is None:
+            logger.warning("Molasses - file locks are not supported here, every process connects upstream")
+            self.is_leader = True
+            return True
+        lock_file = open(self.path, "a")
+        try:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        self.__file = lock_file
+        self.is_leader = True
+        return True
+
+    def release(self):
+        if self.__file is not None:
+            self.__file.close()
+            self.__file = None
+        self.is_leader = False
+
+
+def file_version(path: str):
+    """Identifies the current contents of ``path``; changes whenever the file is replaced."""
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+
+def heartbeat_path(snapshot_path: str) -> str:
+    """File whose mtime the leader bumps whenever it confirms the shared snapshot is current."""
+    return snapshot_path + ".fresh"
+
+
+def touch_heartbeat(path: str, at: float):
+    with open(path, "a"):
+        pass
+    os.utime(path, (at, at))
+
+
+def heartbeat_time(path: str) -> Optional[float]:
+    try:
+        return os.stat(path).st_mtime
+    except FileNotFoundError:
+        return None
@@ -0,0 +1,112 @@
+"""Immutable, versioned sets of compiled features and their on-disk form."""
+
+import json
+import logging
+import os
+import tempfile
+import time
+from collections import namedtuple
+from types import MappingProxyType
+from typing import Dict, Iterable, Optional
+
+from .evaluation import compile_feature, feature_version
+
+logger = logging.getLogger(__name__)
+
+SOURCE_NETWORK = "network"
+SOURCE_DISK = "disk"
+
+FeatureSnapshot = namedtuple("FeatureSnapshot", ["features", "version", "updated_at", "source"])
+FeatureSnapshot.__doc__ = """
+A read-only mapping of feature key to compiled feature.
+
+``version`` starts at 1 for the first snapshot a client loads and grows by
+one every time the feature set changes, so it can be used as a cache key.
+``updated_at`` is when the features were last received from ``source``.
+"""
+
+EMPTY_SNAPSHOT = FeatureSnapshot(MappingProxyType({}), 0, None, None)
+
+
+def updated_snapshot(snapshot: FeatureSnapshot, features: Iterable[Dict], source=SOURCE_NETWORK,
+                     updated_at: Optional[float] = None, remove_missing=True):
+    """
+    Builds the snapshot for the feature set ``features``.
+
+    Only features whose content changed are compiled, and features missing
+    from ``features`` are removed unless ``remove_missing`` is False.
+    Returns the new snapshot and the keys that were added, updated or
+    removed; when nothing changed the version stays the same and only
+    ``updated_at`` and ``source`` are refreshed.
+    """
+    updated_at = updated_at or time.time()
+    current = snapshot.features
+    updated = None
+    changed = []
+    seen = set()
+    for feature in features:
+        key = feature["key"]
+        seen.add(key)
+        version = feature_version(feature)
+        previous = current.get(key)
+        if previous is not None and previous.version == version:
+            continue
+        if updated is None:
+            updated = dict(current)
+        updated[key] = compile_feature(feature, version)
+        changed.append(key)
+    if remove_missing and len(seen) < len(current):
+        removed = [key for key in current if key not in seen]
+        if removed:
+            if updated is None:
+                updated = dict(current)
+            for key in removed:
+                del updated[key]
+            changed.extend(removed)
+    if updated is None:
+        if snapshot.version > 0:
+            return snapshot._replace(updated_at=updated_at, source=source), changed
+        updated = {}
+    return FeatureSnapshot(MappingProxyType(updated), snapshot.version + 1, updated_at, source), changed
+
+
+def save_snapshot_file(path: str, features: Iterable[Dict], saved_at: Optional[float] = None):
+    """Writes the raw ``features`` to ``path``, atomically replacing any previous file."""
+    payload = json.dumps({
+        "savedAt": saved_at or time.time(),
+        "features": list(features),
+    }, separators=(",", ":")).encode("utf-8")
+    fd, tmp_path = tempfile.mkstemp(prefix=".molasses-", dir=os.path.dirname(os.path.abspath(path)))
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(payload)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+def read_snapshot_file(path: str):
+    """
+    Reads a file written by ``save_snapshot_file``.
+
+    Returns the time the file was saved and the raw features it holds, or
+    ``None`` if there is no usable file.
+    """
+    try:
+        with open(path, "rb") as f:
+            raw = f.read()
+        if not raw:
+            return None
+        data = json.loads(raw)
+        return float(data["savedAt"]), list(data["features"])
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError, KeyError, TypeError):
+        logger.warning("Molasses - ignoring unreadable snapshot file %s", path, exc_info=1)
+        return None
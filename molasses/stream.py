@@ -0,0 +1,42 @@
+"""Connection states and reconnect backoff for the event stream."""
+
+import time
+from random import random
+
+STATE_DISCONNECTED = "disconnected"
+STATE_CONNECTING = "connecting"
+STATE_CONNECTED = "connected"
+STATE_BACKOFF = "backoff"
+STATE_STOPPED = "stopped"
+STATES = (STATE_DISCONNECTED, STATE_CONNECTING, STATE_CONNECTED, STATE_BACKOFF, STATE_STOPPED)
+
+
+class ReconnectBackoff:
+    """
+    Picks the delay before each reconnect to the event stream.
+
+    Retries wait 1, 2, 4, 6, ... seconds up to ``max_delay``, less up to
+    ``jitter`` (a fraction) of the delay.
+    Once a connection has stayed up for ``reset_after`` seconds the next
+    disconnect starts the schedule over.
+    """
+
+    def __init__(self, max_delay=64.0, jitter=0.3, reset_after=60.0):
+        self.max_delay = max_delay
+        self.jitter = jitter
+        self.reset_after = reset_after
+        self.attempts = 0
+        self.delay = 0.0
+        self.__connected_at = None
+
+    def connected(self):
+        self.__connected_at = time.monotonic()
+
+    def next(self) -> float:
+        connected_at, self.__connected_at = self.__connected_at, None
+        if connected_at is not None and time.monotonic() - connected_at >= self.reset_after:
+            self.attempts = 0
+        delay = min(max(self.attempts * 2.0, 1.0), self.max_delay)
+        self.delay = delay - random() * self.jitter * delay
+        self.attempts += 1
+        return self.delay
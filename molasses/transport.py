@@ -0,0 +1,81 @@
+"""Pooled HTTP transport shared by feature fetches, the event stream and analytics."""
+
+import socket
+from typing import Dict, List, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+BASE_URL = 'https://sdk.molasses.app/v1'
+
+
+def _make_retry(retries, backoff_factor):
+    options = dict(total=retries, connect=retries, read=0, status=retries,
+                   backoff_factor=backoff_factor, status_forcelist=(502, 503, 504),
+                   raise_on_status=False)
+    # Only GETs are retried on 5xx: a POST that failed with 502 or 504 may
+    # already have been processed, so resending it would duplicate events.
+    # Connection errors are retried for every method.
+    methods = frozenset(["GET"])
+    try:
+        return Retry(allowed_methods=methods, **options)
+    except TypeError:
+        return Retry(method_whitelist=methods, **options)
+
+
+class Transport:
+    """
+    Keep-alive HTTP transport built on a pooled ``requests.Session``.
+
+    Every request uses ``(connect_timeout, read_timeout)`` as its timeout,
+    except the event stream, which reads with ``stream_read_timeout``.
+    Connection errors, and 502/503/504 responses to GETs, are retried up to
+    ``retries`` times with exponential backoff, unless a GET asks for a
+    single attempt with ``retry=False``.
+    """
+
+    def __init__(self, api_key: str, base_url=BASE_URL, pool_size=10, connect_timeout=5.0,
+                 read_timeout=30.0, stream_read_timeout=None, retries=3, backoff_factor=0.5,
+                 session: Optional[requests.Session] = None):
+        self.base_url = base_url
+        self.timeout = (connect_timeout, read_timeout)
+        self.stream_timeout = (connect_timeout, stream_read_timeout)
+        self.session = session or requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size,
+                              max_retries=_make_retry(retries, backoff_factor))
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.__single_attempt = HTTPAdapter(pool_connections=1, pool_maxsize=1, max_retries=0)
+        self.session.headers["Authorization"] = "Bearer " + api_key
+
+    def get(self, path: str, headers: Optional[Dict] = None, timeout: Optional[float] = None, retry=True):
+        timeout = self.timeout if timeout is None else timeout
+        if retry:
+            return self.session.get(self.base_url + path, headers=headers, timeout=timeout)
+        request = self.session.prepare_request(requests.Request("GET", self.base_url + path, headers=headers))
+        settings = self.session.merge_environment_settings(request.url, {}, None, None, None)
+        return self.__single_attempt.send(request, timeout=timeout, **settings)
+
+    def post(self, path: str, json: List[Dict]):
+        return self.session.post(self.base_url + path, json=json, timeout=self.timeout)
+
+    def stream(self, path: str, headers: Optional[Dict] = None):
+        return self.session.get(self.base_url + path, headers=headers, stream=True,
+                                timeout=self.stream_timeout)
+
+    @staticmethod
+    def interrupt(response: requests.Response):
+        """
+        Unblocks the thread reading the streamed ``response`` by shutting its
+        socket down; closing the response from another thread would wait for
+        that read to finish.
+        """
+        try:
+            response.raw.connection.sock.shutdown(socket.SHUT_RDWR)
+        except (AttributeError, OSError):
+            response.close()
+
+    def close(self):
+        self.session.close()
+        self.__single_attempt.close()
@@ -0,0 +1,57 @@
+"""Users prepared once for evaluating many features."""
+
+import zlib
+from typing import Dict
+
+MISSING = object()
+UNSET = object()
+
+
+class UserContext:
+    """
+    A user normalized once so that evaluating many features for it is cheap.
+
+    The percentage bucket of the id is computed up front and each param is
+    converted to the type a constraint compares it as the first time it is
+    needed, then reused. It reads like the user dict it was built from, so
+    it can be passed anywhere a user is accepted.
+    """
+
+    __slots__ = ("user", "id", "params", "encoded_id", "bucket", "typed_values")
+
+    def __init__(self, user: Dict):
+        self.user = user
+        self.id = user.get("id")
+        self.params = user.get("params") or {}
+        self.encoded_id = None
+        self.bucket = None
+        if self.id is not None:
+            self.encoded_id = bytes(self.id, "utf-8")
+            self.bucket = (zlib.crc32(self.encoded_id) & 0xffffffff) % 100
+        self.typed_values = {}
+
+    def typed(self, param: str, coerce):
+        """``coerce`` applied to the value of ``param``, or ``MISSING`` when the user does not have it."""
+        typed_key = (param, coerce)
+        value = self.typed_values.get(typed_key, UNSET)
+        if value is UNSET:
+            if param == "id":
+                value = self.id
+            else:
+                value = self.params.get(param, MISSING)
+            if value is not MISSING:
+                value = coerce(value)
+            self.typed_values[typed_key] = value
+        return value
+
+    def __contains__(self, key):
+        return key in self.user
+
+    def __getitem__(self, key):
+        return self.user[key]
+
+    def get(self, key, default=None):
+        return self.user.get(key, default)
+
+    def __repr__(self):
+        return "UserContext(%r)" % (self.user,)
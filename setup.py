@@ -12,7 +12,6 @@ with open('HISTORY.rst') as history_file:
 
 requirements = [
     "requests==2.24.0",
-    "APScheduler==3.6.3",
     "sseclient-py==1.7",
     "semver==3.0.0-dev.2"
 ]
@@ -38,6 +37,10 @@ setup(
     ],
     description="python SDK for Molasses - feature flags as a service",
     install_requires=requirements,
+    extras_require={
+        "numpy": ["numpy>=1.17"],
+        "async": ["aiohttp>=3.6"],
+    },
     license="MIT license",
     long_description=readme + '\n\n' + history,
     include_package_data=True,
@@ -0,0 +1,33 @@
+"""Feature and file factories shared by the tests."""
+
+import json
+import os
+
+
+def make_feature(constraints, constraint="all", percentage=0):
+    return {
+        "id": "1",
+        "active": True,
+        "key": "FOO_TEST",
+        "segments": [
+            {
+                "constraint": constraint,
+                "percentage": 100,
+                "segmentType": "alwaysExperiment",
+                "userConstraints": constraints,
+            },
+            {
+                "constraint": "all",
+                "percentage": percentage,
+                "segmentType": "everyoneElse",
+                "userConstraints": [],
+            },
+        ],
+    }
+
+
+def write_features(path, features):
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump({"data": {"features": features}}, f)
+    os.replace(tmp, path)
@@ -0,0 +1,207 @@
+#!/usr/bin/env python
+
+"""Tests for `molasses.aio`."""
+
+import asyncio
+import json
+
+import pytest
+
+from .test_molasses_python import responseA, responseD
+
+aiohttp = pytest.importorskip("aiohttp")
+web = pytest.importorskip("aiohttp.web")
+
+from molasses.aio import AsyncEventQueue, AsyncMolassesClient  # noqa: E402
+
+
+def run_async(coroutine):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+
+async def start_server(events, requests=None, authorizations=None, stream_seconds=0.5):
+    @web.middleware
+    async def record_authorization(request, handler):
+        if authorizations is not None:
+            authorizations.append((request.path, request.headers.get("Authorization")))
+        return await handler(request)
+
+    async def features(request):
+        assert request.headers["Authorization"] == "Bearer test_key"
+        return web.json_response(responseD)
+
+    async def event_stream(request):
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        await response.write(b": hello\n\n")
+        await response.write(("data: " + json.dumps(responseA) + "\n\n").encode("utf-8"))
+        await asyncio.sleep(stream_seconds)
+        return response
+
+    async def analytics(request):
+        batch = await request.json()
+        events.extend(batch)
+        if requests is not None:
+            requests.append(len(batch))
+        return web.json_response({})
+
+    app = web.Application(middlewares=[record_authorization])
+    app.router.add_get("/v1/features", features)
+    app.router.add_get("/v1/event-stream", event_stream)
+    app.router.add_post("/v1/analytics", analytics)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, "http://127.0.0.1:%d/v1" % port
+
+
+def test_polling_and_events():
+    async def run():
+        events = []
+        runner, base_url = await start_server(events)
+        try:
+            client = AsyncMolassesClient("test_key", polling=True, auto_send_events=True,
+                                         base_url=base_url)
+            async with client:
+                assert client.is_active("FOO_TEST") is True
+                assert client.is_active("FOO_FALSE_TEST") is False
+                assert client.is_active("FOO_50_PERCENT_TEST", {"id": "123", "params": {}}) is True
+                await client.track("Clicked button", {"id": "123"}, {"version": "v2"})
+                client.experiment_success("FOO_50_PERCENT_TEST", {"id": "123", "params": {}})
+                assert await client.track("Clicked button", None) is False
+                assert await client.experiment_started("MISSING", {"id": "123"}) is False
+        finally:
+            await runner.cleanup()
+        return events
+
+    events = run_async(run())
+    assert sorted(e["event"] for e in events) == [
+        "Clicked button", "experiment_started", "experiment_success"]
+
+
+def test_streaming():
+    async def run():
+        runner, base_url = await start_server([])
+        try:
+            async with AsyncMolassesClient("test_key", base_url=base_url) as client:
+                assert client.is_active("FOO_TEST") is False
+                for _ in range(100):
+                    if client.is_active("FOO_TEST"):
+                        break
+                    await asyncio.sleep(0.01)
+                assert client.is_active("FOO_TEST", {"id": "foodie", "params": {
+                    "isBetaUser": "true"}}) is True
+        finally:
+            await runner.cleanup()
+
+    run_async(run())
+
+
+def test_events_are_batched():
+    async def run():
+        events = []
+        requests = []
+        runner, base_url = await start_server(events, requests)
+        try:
+            client = AsyncMolassesClient("test_key", polling=True, auto_send_events=True,
+                                         base_url=base_url, events_batch_size=100, events_linger=5)
+            async with client:
+                for i in range(250):
+                    client.is_active("FOO_50_PERCENT_TEST", {"id": str(i), "params": {}})
+                assert await client.events.flush(5) is True
+                assert client.events.stats()["sent"] == 250
+        finally:
+            await runner.cleanup()
+        return events, requests
+
+    events, requests = run_async(run())
+    assert len(events) == 250
+    assert requests == [100, 100, 50]
+
+
+def test_idle_stream_reconnects():
+    async def run():
+        authorizations = []
+        runner, base_url = await start_server([], authorizations=authorizations, stream_seconds=2)
+        try:
+            async with AsyncMolassesClient("test_key", base_url=base_url, stream_idle_timeout=0.1):
+                for _ in range(180):
+                    if len(authorizations) >= 2:
+                        break
+                    await asyncio.sleep(0.01)
+        finally:
+            await runner.cleanup()
+        return authorizations
+
+    assert [path for path, _ in run_async(run())][:2] == ["/v1/event-stream"] * 2
+
+
+def test_caller_session_is_authorized():
+    async def run():
+        authorizations = []
+        runner, base_url = await start_server([], authorizations=authorizations)
+        try:
+            async with aiohttp.ClientSession() as session:
+                for polling in (True, False):
+                    client = AsyncMolassesClient("test_key", polling=polling, base_url=base_url,
+                                                 session=session, events_linger=0)
+                    async with client:
+                        await client.track("Clicked button", {"id": "123"})
+                        await client.events.flush(5)
+                        for _ in range(100):
+                            if polling or ("/v1/event-stream", "Bearer test_key") in authorizations:
+                                break
+                            await asyncio.sleep(0.01)
+        finally:
+            await runner.cleanup()
+        return authorizations
+
+    authorizations = run_async(run())
+    assert {path for path, _ in authorizations} == {"/v1/features", "/v1/event-stream", "/v1/analytics"}
+    assert {authorization for _, authorization in authorizations} == {"Bearer test_key"}
+
+
+def test_events_from_another_thread():
+    async def run():
+        events = []
+        runner, base_url = await start_server(events)
+        try:
+            client = AsyncMolassesClient("test_key", polling=True, auto_send_events=True,
+                                         base_url=base_url, events_linger=0)
+            async with client:
+                loop = asyncio.get_event_loop()
+                user = {"id": "123", "params": {}}
+                assert await loop.run_in_executor(
+                    None, client.is_active, "FOO_50_PERCENT_TEST", user) is True
+                queued = await loop.run_in_executor(None, client.track, "Clicked button", user)
+                assert await asyncio.wrap_future(queued) is True
+                assert await client.events.flush(5) is True
+        finally:
+            await runner.cleanup()
+        return events
+
+    events = run_async(run())
+    assert sorted(e["event"] for e in events) == ["Clicked button", "experiment_started"]
+
+
+def test_event_queue_is_bounded():
+    async def run():
+        batches = []
+
+        async def send(batch):
+            batches.append(batch)
+
+        events = AsyncEventQueue(send, max_size=10, batch_size=4, linger=60)
+        assert [events.put(i) for i in range(12)].count(False) == 2
+        assert events.dropped == 2
+        await events.stop(5)
+        assert events.put(12) is False
+        return batches
+
+    assert run_async(run()) == [[0, 1, 2, 3], [4, 5, 6, 7], [8, 9]]
@@ -0,0 +1,29 @@
+#!/usr/bin/env python
+
+"""Smoke test for the benchmark suite."""
+
+import json
+
+from benchmarks.load import run_load
+from benchmarks.run import main
+
+
+def test_benchmarks_write_json(tmpdir):
+    path = str(tmpdir.join("benchmark.json"))
+    main(["--quick", "--only", "user_percentage", "--only", "analytics", "--only", "threads",
+          "--output", path])
+    with open(path) as f:
+        report = json.load(f)
+    names = [result["name"] for result in report["results"]]
+    assert names == ["get_user_percentage", "analytics_throughput"] + ["is_active_threads"] * 4
+    assert report["results"][1]["events_received"] == 1000
+    assert [result["params"]["threads"] for result in report["results"][2:]] == [1, 2, 4, 8]
+
+
+def test_load_harness():
+    report = run_load(features=200, updates=20, threads=2, duration=1.0, sample_interval=0.2)
+    assert report["updates_observed"] > 0
+    assert 0 < report["propagation_seconds"]["p50"] <= report["propagation_seconds"]["max"]
+    assert report["evaluations_per_second"] > 0
+    assert report["analytics_events_per_second"] > 0
+    assert report["memory"][0]["rss_bytes"] > 0
@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+
+"""Tests for `molasses.bulk`."""
+
+import csv
+import io
+import json
+
+import pytest
+
+from molasses import MolassesClient
+from molasses.bulk import guess_format, main, run
+
+from .helpers import make_feature, write_features
+
+FEATURES = [
+    make_feature([{"userParam": "plan", "operator": "equals", "values": "pro"}], percentage=50),
+    dict(make_feature([]), key="BAR_TEST", active=False),
+]
+USERS = [{"id": "user-%d" % i, "params": {"plan": "pro"} if i % 3 == 0 else {}} for i in range(200)]
+
+
+def users_csv():
+    return "id,plan\n" + "".join("%s,%s\n" % (user["id"], user["params"].get("plan", "")) for user in USERS)
+
+
+def users_jsonl():
+    return "".join(json.dumps(user) + "\n" for user in USERS)
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_assignments_match_is_active(tmpdir, workers):
+    path = str(tmpdir.join("features.json"))
+    write_features(path, FEATURES)
+    molasses = MolassesClient("test_key", features_file=path)
+    out = io.StringIO()
+    stats = run(FEATURES, io.StringIO(users_csv()), out, workers=workers, chunk_size=16)
+    rows = list(csv.DictReader(io.StringIO(out.getvalue())))
+    try:
+        expected = [(user["id"], key, molasses.is_active(key, user))
+                    for user in USERS for key in ("BAR_TEST", "FOO_TEST")]
+    finally:
+        molasses.stop()
+    assert [(row["user_id"], row["feature"], row["active"] == "true") for row in rows] == expected
+    assert stats["users"] == len(USERS)
+    assert stats["rows"] == 2 * len(USERS)
+    assert stats["rows_per_second"] > 0
+
+
+def test_jsonl_and_selected_features():
+    out = io.StringIO()
+    run(FEATURES, io.StringIO(users_jsonl()), out, keys=["FOO_TEST"], input_format="jsonl",
+        output_format="jsonl", workers=1)
+    rows = [json.loads(line) for line in out.getvalue().splitlines()]
+    assert len(rows) == len(USERS)
+    assert rows[0] == {"userId": "user-0", "feature": "FOO_TEST", "active": True}
+
+
+def test_rejects_unknown_features_and_missing_ids():
+    with pytest.raises(ValueError):
+        run(FEATURES, io.StringIO(users_csv()), io.StringIO(), keys=["MISSING"])
+    with pytest.raises(ValueError):
+        run(FEATURES, io.StringIO("user,plan\n"), io.StringIO(), id_column="id")
+
+
+def test_cli(tmpdir, capsys):
+    features_path = str(tmpdir.join("features.json"))
+    users_path = tmpdir.join("users.jsonl")
+    out_path = str(tmpdir.join("assignments.csv"))
+    write_features(features_path, FEATURES)
+    users_path.write(users_jsonl())
+    stats = main(["--features-file", features_path, str(users_path), "-o", out_path, "--workers", "1"])
+    with open(out_path) as f:
+        assert sum(1 for _ in f) == 1 + 2 * len(USERS)
+    assert stats["rows"] == 2 * len(USERS)
+    assert "rows/s" in capsys.readouterr().err
+    assert guess_format("users.ndjson") == "jsonl"
+    assert guess_format("-") == "csv"
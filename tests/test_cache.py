@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+
+"""Tests for `molasses.cache`."""
+
+import time
+
+from molasses.cache import ResultCache
+from molasses.evaluation import compile_feature
+
+from .helpers import make_feature
+
+
+def test_hits_ignore_unread_params():
+    feature = compile_feature(make_feature([
+        {"userParam": "country", "operator": "in", "values": "us,ca"},
+    ]))
+    cache = ResultCache(maxsize=10)
+    assert cache.evaluate(feature, {"id": "1", "params": {"country": "us"}}) is True
+    assert cache.evaluate(feature, {"id": "1", "params": {"country": "us", "other": 1}}) is True
+    assert cache.evaluate(feature, {"id": "1", "params": {"country": "mx"}}) is False
+    assert cache.evaluate(feature, {"id": "1", "params": {}}) is False
+    assert cache.stats() == {"hits": 1, "misses": 3, "size": 3}
+
+
+def test_value_types_are_part_of_the_key():
+    feature = compile_feature(make_feature([
+        {"userParam": "flag", "operator": "equals", "values": "1"},
+    ]))
+    cache = ResultCache(maxsize=10)
+    assert cache.evaluate(feature, {"id": "1", "params": {"flag": 1}}) is True
+    assert cache.evaluate(feature, {"id": "1", "params": {"flag": True}}) is False
+
+
+def test_new_feature_versions_miss():
+    cache = ResultCache(maxsize=10)
+    user = {"id": "1", "params": {"country": "us"}}
+    first = compile_feature(make_feature([
+        {"userParam": "country", "operator": "in", "values": "us"},
+    ]))
+    second = compile_feature(make_feature([
+        {"userParam": "country", "operator": "in", "values": "ca"},
+    ]))
+    assert cache.evaluate(first, user) is True
+    assert cache.evaluate(second, user) is False
+    cache.invalidate(["FOO_TEST"])
+    assert len(cache) == 0
+
+
+def test_size_and_ttl_bounds():
+    feature = compile_feature(make_feature([], percentage=50))
+    cache = ResultCache(maxsize=2, ttl=0.05)
+    for id in ["1", "2", "3"]:
+        cache.evaluate(feature, {"id": id, "params": {}})
+    assert len(cache) == 2
+    cache.evaluate(feature, {"id": "3", "params": {}})
+    assert cache.hits == 1
+    time.sleep(0.06)
+    cache.evaluate(feature, {"id": "3", "params": {}})
+    assert cache.hits == 1
+
+
+def test_invalidate_only_touches_changed_features():
+    foo = compile_feature(make_feature([], percentage=50))
+    bar = compile_feature(dict(make_feature([], percentage=50), key="BAR_TEST"))
+    cache = ResultCache(maxsize=3)
+    for id in ["1", "2"]:
+        cache.evaluate(foo, {"id": id, "params": {}})
+        cache.evaluate(bar, {"id": id, "params": {}})
+    assert len(cache) == 3
+    cache.invalidate(["BAR_TEST"])
+    assert len(cache) == 1
+    cache.evaluate(foo, {"id": "2", "params": {}})
+    assert cache.hits == 1
+    cache.invalidate(["FOO_TEST", "MISSING"])
+    assert len(cache) == 0
@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+
+"""Tests for `molasses.evaluation`."""
+
+import random
+import sys
+
+import pytest
+import semver
+
+from molasses.evaluation import (compile_feature, feature_index_size, get_user_percentage, is_feature_active,
+                                 semver_key)
+from molasses.membership import SORTED_INDEX_THRESHOLD, SortedIndex, index_size
+
+from .helpers import make_feature
+
+
+def test_compiles_in_lists_to_sets():
+    feature = compile_feature(make_feature([
+        {"userParam": "country", "operator": "in", "values": "us,ca"},
+    ]))
+    constraint = feature.always_experiment.constraints[0]
+    assert constraint.value == frozenset(["us", "ca"])
+    assert is_feature_active(feature, {"id": "1", "params": {"country": "ca"}}) is True
+    assert is_feature_active(feature, {"id": "1", "params": {"country": "mx"}}) is False
+
+
+def test_compiled_features_keep_only_evaluated_fields():
+    param = "".join(["country", "_code"])
+    raw = make_feature([{"userParam": param, "operator": "equals", "values": "us"}])
+    raw["description"] = "not needed to evaluate"
+    feature = compile_feature(raw)
+    assert not hasattr(feature, "__dict__")
+    assert not hasattr(feature, "description")
+    assert feature.params == ("country_code",)
+    assert feature.always_experiment.constraints[0].param is sys.intern(param)
+
+
+def test_unparseable_constraint_never_matches():
+    feature = compile_feature(make_feature([
+        {"userParam": "age", "userParamType": "number", "operator": "gt", "values": "old"},
+        {"userParam": "app", "userParamType": "semver", "operator": "gt", "values": "nope"},
+        {"userParam": "count", "userParamType": "number", "operator": "in", "values": "1,2"},
+    ], constraint="any"))
+    assert is_feature_active(feature, {"id": "1", "params": {
+        "age": 3, "app": "1.0.0", "count": 1}}) is False
+
+
+def test_empty_all_segment_matches_everyone():
+    feature = compile_feature(make_feature([]))
+    assert is_feature_active(feature, {"id": "1", "params": {}}) is True
+    feature = compile_feature(make_feature([], constraint="any"))
+    assert is_feature_active(feature, {"id": "1", "params": {}}) is False
+
+
+def test_inactive_feature():
+    raw = make_feature([])
+    raw["active"] = False
+    assert is_feature_active(compile_feature(raw)) is False
+
+
+def test_batch_matches_scalar_evaluation():
+    np = pytest.importorskip("numpy")
+    from molasses.batch import evaluate_users
+
+    raw = make_feature([
+        {"userParam": "country", "operator": "in", "values": "us,ca"},
+        {"userParam": "age", "userParamType": "number", "operator": "gte", "values": 21},
+        {"userParam": "name", "operator": "contains", "values": "alice bob"},
+        {"userParam": "app", "userParamType": "semver", "operator": "lt", "values": "2.0.0"},
+        {"userParam": "beta", "userParamType": "boolean", "operator": "equals", "values": True},
+    ], constraint="any", percentage=37)
+    raw["segments"].append({
+        "constraint": "all",
+        "percentage": 100,
+        "segmentType": "alwaysControl",
+        "userConstraints": [{"userParam": "id", "operator": "nin", "values": "u1,u2,u3,u4,u5"}],
+    })
+    feature = compile_feature(raw)
+    rng = random.Random(7)
+    ids = ["u%d" % i for i in range(500)]
+    columns = {
+        "country": [rng.choice(["us", "ca", "mx", None]) for _ in ids],
+        "age": [rng.choice([18, "30", True, None]) for _ in ids],
+        "name": [rng.choice(["alice", "carol", "", None]) for _ in ids],
+        "app": [rng.choice(["1.9.9", "2.0.0", None]) for _ in ids],
+        "beta": [rng.choice([True, False, "true", None]) for _ in ids],
+    }
+    expected = []
+    for i, id in enumerate(ids):
+        params = {k: v[i] for k, v in columns.items() if v[i] is not None}
+        expected.append(is_feature_active(feature, {"id": id, "params": params}))
+
+    result = evaluate_users(feature, ids, columns)
+    assert result.dtype == np.bool_
+    assert result.tolist() == expected
+
+
+def test_large_in_lists_use_sorted_index():
+    ids = ",".join("user-%d" % i for i in range(SORTED_INDEX_THRESHOLD + 1))
+    feature = compile_feature(make_feature([
+        {"userParam": "id", "operator": "in", "values": ids},
+    ]))
+    index = feature.always_experiment.constraints[0].value
+    assert isinstance(index, SortedIndex)
+    assert len(index) == SORTED_INDEX_THRESHOLD + 1
+    assert is_feature_active(feature, {"id": "user-0", "params": {}}) is True
+    assert is_feature_active(feature, {"id": "user-%d" % SORTED_INDEX_THRESHOLD, "params": {}}) is True
+    assert is_feature_active(feature, {"id": "user-", "params": {}}) is False
+    assert is_feature_active(feature, {"id": "zzz", "params": {}}) is False
+    assert index_size(index) < index_size(frozenset(index))
+    assert feature_index_size(feature) == index_size(index)
+
+
+def test_semver_precedence_and_malformed_versions():
+    feature = compile_feature(make_feature([
+        {"userParam": "app", "userParamType": "semver", "operator": "gt", "values": "1.2.0-beta.2"},
+    ]))
+    for version, expected in [("1.2.0", True), ("1.2.0-beta.10", True), ("1.2.0-beta.2", False),
+                              ("1.2.0-alpha", False), ("1.2.0-beta.2.1", True),
+                              ("1.2.0-beta.x", True), ("not a version", False), (3, False)]:
+        user = {"id": "1", "params": {"app": version}}
+        assert is_feature_active(feature, user) is expected, version
+        if semver_key(str(version)) is not None:
+            assert (semver.Version.parse(version) > semver.Version.parse("1.2.0-beta.2")) is expected
+    assert semver_key("1.0.0+build.1") == semver_key("1.0.0")
+
+
+def test_batch_buckets_match_user_percentage():
+    np = pytest.importorskip("numpy")
+    from molasses.batch import crc32_buckets, evaluate_users
+    ids = ["user-%d" % i for i in range(500)] + ["ünïcode", ""]
+    expected = [get_user_percentage(id, 37) for id in ids]
+    assert list(crc32_buckets(ids) < 37) == expected
+    feature = compile_feature(make_feature([{"userParam": "id", "operator": "equals", "values": "user-3"}],
+                                           percentage=37))
+    expected = [is_feature_active(feature, {"id": id, "params": {}}) for id in ids]
+    assert np.array_equal(evaluate_users(feature, ids), expected)
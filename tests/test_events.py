@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+
+"""Tests for `molasses.events`."""
+
+import threading
+import time
+
+from molasses.events import EventLimiter, EventQueue, ExposureFilter, track_event
+
+
+def test_sends_in_batches():
+    batches = []
+    events = EventQueue(batches.append, batch_size=3, linger=10)
+    for i in range(7):
+        assert events.put({"event": i}) is True
+    events.stop()
+    assert [len(b) for b in batches] == [3, 3, 1]
+    assert [e["event"] for b in batches for e in b] == list(range(7))
+    assert events.stats() == {"enqueued": 7, "dropped": 0, "sent": 7, "failed": 0, "depth": 0}
+
+
+def test_flush_does_not_wait_for_linger():
+    batches = []
+    events = EventQueue(batches.append, batch_size=100, linger=60)
+    events.put({"event": "a"})
+    assert events.flush(timeout=5) is True
+    assert batches == [[{"event": "a"}]]
+    events.stop()
+
+
+def test_drops_when_full():
+    release = threading.Event()
+
+    def send(batch):
+        release.wait(5)
+
+    events = EventQueue(send, max_size=1, batch_size=1, linger=0)
+    results = [events.put({"event": i}) for i in range(10)]
+    assert results.count(False) == events.dropped
+    assert events.dropped >= 8
+    release.set()
+    events.stop()
+
+
+def test_stop_honors_its_timeout_when_full():
+    release = threading.Event()
+    events = EventQueue(lambda batch: release.wait(5), max_size=1, batch_size=1, linger=0)
+    events.put({"event": 1})
+    while events.depth:
+        time.sleep(0.001)
+    events.put({"event": 2})
+    start = time.monotonic()
+    events.stop(0.1)
+    assert time.monotonic() - start < 1
+    release.set()
+
+
+def test_send_failures_are_counted():
+    def send(batch):
+        raise IOError("boom")
+
+    events = EventQueue(send, batch_size=10, linger=0)
+    events.put({"event": "a"})
+    events.stop()
+    assert events.failed == 1
+    assert events.put({"event": "b"}) is False
+
+
+def test_exposure_filter_suppresses_repeats():
+    exposures = ExposureFilter(window=60)
+    assert exposures.should_send("1", "foo", True) is True
+    assert exposures.should_send("1", "foo", True) is False
+    assert exposures.should_send("1", "foo", False) is True
+    assert exposures.should_send("1", "bar", True) is True
+    assert exposures.stats() == {"suppressed": 1, "size": 3}
+
+
+def test_exposure_filter_expiry_and_bounds():
+    exposures = ExposureFilter(window=0.05, max_size=2)
+    for user_id in ("a", "b", "c"):
+        assert exposures.should_send("1", user_id, True) is True
+    assert len(exposures) == 2
+    assert exposures.should_send("1", "a", True) is True
+    time.sleep(0.06)
+    assert exposures.should_send("1", "c", True) is True
+    assert len(exposures) == 1
+    assert exposures.suppressed == 0
+
+
+def test_sampling_is_deterministic_per_user():
+    limiter = EventLimiter({"Clicked": 0.25})
+    kept = []
+    for i in range(2000):
+        event = limiter.admit(track_event("Clicked", {"id": "u%d" % i, "params": {}}))
+        if event is not None:
+            assert event["tags"] == {"sampleRate": 0.25}
+            kept.append(event["userId"])
+    assert 400 < len(kept) < 600
+    assert limiter.sampled_out == 2000 - len(kept)
+    again = [e["userId"] for e in (limiter.admit(track_event("Clicked", {"id": "u%d" % i}))
+                                   for i in range(2000)) if e is not None]
+    assert again == kept
+    other = limiter.admit(track_event("Purchased", {"id": "u1", "params": {}}))
+    assert other["tags"] == {}
+
+
+def test_rate_limit():
+    limiter = EventLimiter(rate_limit=10, burst=5)
+    admitted = [limiter.admit(track_event("Clicked", {"id": "u1"})) for _ in range(8)]
+    assert sum(event is not None for event in admitted) == 5
+    assert limiter.stats() == {"sampled_out": 0, "rate_limited": 3}
+    time.sleep(0.12)
+    assert limiter.admit(track_event("Clicked", {"id": "u1"})) is not None
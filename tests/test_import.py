@@ -0,0 +1,40 @@
+#!/usr/bin/env python
+
+"""Guards against regressions in the cost of `import molasses`."""
+
+import json
+import subprocess
+import sys
+
+MEASURE = """
+import json, resource, sys, time
+before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+start = time.perf_counter()
+import molasses
+elapsed = time.perf_counter() - start
+after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+print(json.dumps({
+    "seconds": elapsed,
+    "rss_growth_kb": after - before,
+    "modules": sorted(sys.modules),
+}))
+"""
+
+LAZY_MODULES = ["apscheduler", "sseclient", "semver", "numpy", "aiohttp"]
+
+
+def measure_import():
+    output = subprocess.check_output([sys.executable, "-c", MEASURE])
+    return json.loads(output.decode("utf-8"))
+
+
+def test_optional_modules_are_not_imported():
+    modules = measure_import()["modules"]
+    for name in LAZY_MODULES:
+        assert name not in modules
+
+
+def test_import_time_and_memory():
+    result = min((measure_import() for _ in range(3)), key=lambda r: r["seconds"])
+    assert result["seconds"] < 1.0
+    assert result["rss_growth_kb"] < 40 * 1024
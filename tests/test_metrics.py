@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+
+"""Tests for `molasses.metrics`."""
+
+import responses
+
+from molasses import MolassesClient
+from molasses.events import EventQueue
+from molasses.metrics import Histogram, Instrumentation, MetricsRecorder, render_prometheus
+from molasses.snapshot import EMPTY_SNAPSHOT
+from molasses.stream import STATE_BACKOFF, ReconnectBackoff
+
+from .helpers import make_feature
+
+
+def test_histogram_buckets():
+    histogram = Histogram((1, 5))
+    for value in (0.5, 1, 3, 10):
+        histogram.observe(value)
+    assert histogram.counts == [2, 1, 1]
+    assert histogram.count == 4
+    assert histogram.sum == 14.5
+
+
+@responses.activate
+def test_evaluations_are_not_timed_by_default():
+    responses.add(responses.GET, 'https://sdk.molasses.app/v1/features',
+                  json={"data": {"features": [make_feature([])]}}, status=200)
+    calls = []
+
+    class Recording(Instrumentation):
+        def evaluation(self, key, seconds):
+            calls.append(key)
+
+        def fetch(self, status, seconds, size):
+            calls.append(status)
+
+    molasses = MolassesClient("test_key", polling=True, instrumentation=Recording())
+    assert molasses.is_active("FOO_TEST") is True
+    molasses.stop()
+    assert calls == [200]
+
+
+@responses.activate
+def test_prometheus_text():
+    responses.add(responses.GET, 'https://sdk.molasses.app/v1/features',
+                  json={"data": {"features": [make_feature([])]}}, status=200)
+
+    recorder = MetricsRecorder(evaluation_sample_rate=1.0)
+    molasses = MolassesClient("test_key", polling=True, result_cache_size=10,
+                              instrumentation=recorder)
+    molasses.is_active("FOO_TEST", {"id": "foo", "params": {}})
+    molasses.is_active("FOO_TEST", {"id": "foo", "params": {}})
+    molasses.stop()
+
+    text = render_prometheus(molasses)
+    lines = text.splitlines()
+    assert "molasses_ready 1" in lines
+    assert "molasses_snapshot_version 1" in lines
+    assert "molasses_snapshot_features 1" in lines
+    assert "molasses_result_cache_hits_total 1" in lines
+    assert "molasses_result_cache_misses_total 1" in lines
+    assert 'molasses_events_total{outcome="dropped"} 0' in lines
+    assert "molasses_events_queue_depth 0" in lines
+    assert 'molasses_evaluation_seconds_count{feature="FOO_TEST"} 2' in lines
+    assert 'molasses_evaluation_seconds_bucket{feature="FOO_TEST",le="+Inf"} 2' in lines
+    assert 'molasses_fetches_total{status="200"} 1' in lines
+    assert "molasses_fetch_duration_seconds_count 1" in lines
+    assert "# TYPE molasses_evaluation_seconds histogram" in lines
+    assert not any(line.startswith("molasses_stream") for line in lines)
+    assert text.endswith("\n")
+
+
+class FakeClient:
+    polling = False
+    is_ready = False
+    snapshot = EMPTY_SNAPSHOT
+    snapshot_age = None
+    connection_state = STATE_BACKOFF
+    reconnect_count = 3
+    result_cache = None
+    exposures = None
+    event_limiter = None
+
+    def __init__(self, instrumentation=None):
+        self.instrumentation = instrumentation
+        self.reconnect_backoff = ReconnectBackoff()
+        self.events = EventQueue(lambda batch: None)
+
+
+def test_prometheus_stream_state():
+    lines = render_prometheus(FakeClient()).splitlines()
+    assert 'molasses_stream_state{state="backoff"} 1' in lines
+    assert 'molasses_stream_state{state="connected"} 0' in lines
+    assert "molasses_stream_connected 0" in lines
+    assert "molasses_stream_reconnects_total 3" in lines
+    assert not any(line.startswith("molasses_snapshot_age") for line in lines)
+
+
+def test_prometheus_label_escaping():
+    recorder = MetricsRecorder()
+    recorder.evaluation('say "hi"\n', 0.5)
+    assert 'feature="say \\"hi\\"\\n"' in render_prometheus(FakeClient(recorder))
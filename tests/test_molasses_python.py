@@ -2,10 +2,18 @@
 
 """Tests for `molasses_python` package."""
 
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
 import pytest
 
 from molasses import MolassesClient
+from molasses.snapshot import save_snapshot_file
+from molasses.transport import Transport
 
+import requests
 import responses
 
 responseA = {
@@ -375,6 +383,316 @@ def test_basic():
                               "isScaredUser": "true"}}) is False
     assert molasses.is_active("FOO_TEST", {"id": "foodie", "params": {
                               "isBetaUser": "true"}}) is True
+    assert list(molasses.membership_index_sizes()) == ["FOO_TEST"]
+
+
+@responses.activate
+def test_custom_transport():
+    responses.add(responses.GET, 'https://example.com/v1/features',
+                  json=responseA, status=200)
+
+    transport = Transport("other_key", base_url="https://example.com/v1",
+                          connect_timeout=1, read_timeout=2)
+    molasses = MolassesClient("test_key", polling=True, transport=transport)
+    assert molasses.is_active("FOO_TEST") is True
+    assert responses.calls[0].request.headers["Authorization"] == "Bearer other_key"
+    assert transport.timeout == (1, 2)
+    molasses.stop()
+
+
+def test_only_gets_are_retried_on_server_errors():
+    retry = Transport("test_key").session.get_adapter("https://sdk.molasses.app/v1").max_retries
+    assert retry.is_retry("GET", 503) is True
+    assert retry.is_retry("POST", 502) is False
+    assert retry.is_retry("POST", 503, has_retry_after=True) is False
+    assert retry.connect == 3
+
+
+@responses.activate
+def test_fetch_errors_are_logged():
+    responses.add(responses.GET, 'https://sdk.molasses.app/v1/features',
+                  body=requests.ConnectionError("refused"))
+
+    molasses = MolassesClient("test_key", polling=True)
+    assert molasses.is_active("FOO_TEST") is False
+    molasses.stop()
+
+
+@responses.activate
+def test_clients_do_not_share_features():
+    responses.add(responses.GET, 'https://sdk.molasses.app/v1/features',
+                  json=responseA, status=200)
+    responses.add(responses.GET, 'https://example.com/v1/features',
+                  json=responseD, status=200)
+
+    first = MolassesClient("test_key", polling=True)
+    second = MolassesClient("other_key", polling=True, base_url="https://example.com/v1")
+    assert first.is_active("FOO_FALSE_TEST") is False
+    assert "FOO_FALSE_TEST" not in first.snapshot.features
+    assert "FOO_FALSE_TEST" in second.snapshot.features
+    assert first.snapshot.version == 1
+    first.stop()
+    second.stop()
+
+
+@responses.activate
+def test_snapshot_file(tmpdir):
+    path = str(tmpdir.join("features.json"))
+    responses.add(responses.GET, 'https://sdk.molasses.app/v1/features',
+                  json=responseD, status=200)
+    molasses = MolassesClient("test_key", polling=True, snapshot_path=path)
+    assert molasses.snapshot.source == "network"
+    molasses.stop()
+
+    responses.replace(responses.GET, 'https://sdk.molasses.app/v1/features',
+                      body=requests.ConnectionError("offline"))
+    molasses = MolassesClient("test_key", polling=True, snapshot_path=path)
+    assert molasses.is_active("FOO_TEST") is True
+    assert molasses.is_active("FOO_FALSE_TEST") is False
+    assert molasses.snapshot.source == "disk"
+    assert molasses.snapshot_age >= 0
+    molasses.stop()
+
+
+@responses.activate
+def test_readiness_when_streaming():
+    responses.add(responses.GET, 'https://sdk.molasses.app/v1/event-stream',
+                  body="data: " + json.dumps(responseA) + "\n\n", status=200,
+                  content_type="text/event-stream")
+    ready = threading.Event()
+
+    molasses = MolassesClient("test_key")
+    molasses.on_ready(ready.set)
+    assert molasses.wait_until_ready(5) is True
+    assert molasses.is_ready is True
+    assert ready.wait(5) is True
+    assert molasses.is_active("FOO_TEST") is True
+    calls = []
+    molasses.on_ready(lambda: calls.append(True))
+    assert calls == [True]
+    molasses.stop()
+
+
+@responses.activate
+def test_stream_resumes_from_last_event_id():
+    last_event_ids = []
+
+    def stream(request):
+        last_event_ids.append(request.headers.get("Last-Event-ID"))
+        body = "id: %d\ndata: %s\n\n" % (len(last_event_ids), json.dumps(responseA))
+        return (200, {"Content-Type": "text/event-stream"}, body)
+
+    responses.add_callback(responses.GET, 'https://sdk.molasses.app/v1/event-stream',
+                           callback=stream)
+
+    molasses = MolassesClient("test_key")
+    assert wait_for(lambda: len(last_event_ids) >= 2)
+    molasses.stop()
+    assert last_event_ids[:2] == [None, "1"]
+    assert molasses.reconnect_count >= 1
+    assert wait_for(lambda: molasses.connection_state == "stopped")
+    assert molasses.is_active("FOO_TEST") is True
+
+
+@responses.activate
+def test_bootstrap_fetch():
+    responses.add(responses.GET, 'https://sdk.molasses.app/v1/features',
+                  json=responseD, status=200)
+    responses.add(responses.GET, 'https://sdk.molasses.app/v1/event-stream',
+                  status=503)
+
+    molasses = MolassesClient("test_key", bootstrap_timeout=2)
+    assert molasses.is_ready is True
+    assert molasses.is_active("FOO_FALSE_TEST") is False
+    assert molasses.is_active("FOO_TEST") is True
+    molasses.stop()
+
+
+class UnavailableHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        self.server.paths.append(self.path)
+        if self.server.hang:
+            self.server.released.wait(5)
+        self.send_response(503)
+        self.send_header("Retry-After", "3")
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.mark.parametrize("hang", [False, True])
+def test_bootstrap_timeout_bounds_the_constructor(hang):
+    server = HTTPServer(("127.0.0.1", 0), UnavailableHandler)
+    server.daemon_threads = True
+    server.paths = []
+    server.hang = hang
+    server.released = threading.Event()
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    try:
+        start = time.monotonic()
+        molasses = MolassesClient("test_key", base_url="http://127.0.0.1:%d/v1" % server.server_port,
+                                  bootstrap_timeout=0.5)
+        elapsed = time.monotonic() - start
+        molasses.stop(1)
+        assert elapsed < 1.0
+        assert molasses.is_ready is False
+        assert server.paths.count("/v1/features") == 1
+    finally:
+        server.released.set()
+        server.shutdown()
+        server.server_close()
+
+
+class ProxyHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        self.server.paths.append(self.path)
+        body = json.dumps(responseD).encode("utf-8") if self.path.endswith("/features") else b""
+        self.send_response(200 if body else 503)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def test_bootstrap_fetch_uses_session_proxies():
+    server = HTTPServer(("127.0.0.1", 0), ProxyHandler)
+    server.paths = []
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    try:
+        transport = Transport("test_key", base_url="http://molasses.invalid/v1", retries=0)
+        transport.session.proxies = {"http": "http://127.0.0.1:%d" % server.server_port}
+        molasses = MolassesClient("test_key", transport=transport, bootstrap_timeout=2)
+        molasses.stop(1)
+        assert molasses.is_active("FOO_TEST") is True
+        assert server.paths[0] == "http://molasses.invalid/v1/features"
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+@responses.activate
+def test_not_ready_without_features():
+    responses.add(responses.GET, 'https://sdk.molasses.app/v1/features',
+                  status=500)
+
+    molasses = MolassesClient("test_key", polling=True)
+    assert molasses.is_ready is False
+    assert molasses.wait_until_ready(0.01) is False
+    molasses.stop()
+
+
+@responses.activate
+def test_conditional_polling():
+    requests_seen = []
+
+    def features(request):
+        requests_seen.append(request.headers.get("If-None-Match"))
+        if request.headers.get("If-None-Match") == '"v1"':
+            return (304, {}, "")
+        return (200, {"ETag": '"v1"'}, json.dumps(responseD))
+
+    responses.add_callback(responses.GET, 'https://sdk.molasses.app/v1/features',
+                           callback=features)
+
+    molasses = MolassesClient("test_key", polling=True, polling_interval=0.05,
+                              polling_max_interval=0.1)
+    for _ in range(100):
+        if len(requests_seen) >= 3:
+            break
+        time.sleep(0.02)
+    molasses.stop()
+    assert requests_seen[:3] == [None, '"v1"', '"v1"']
+    assert molasses.snapshot.version == 1
+    assert molasses.is_active("FOO_TEST") is True
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.time() + timeout
+    while not condition() and time.time() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+@responses.activate
+def test_shared_snapshot(tmpdir):
+    path = str(tmpdir.join("features.json"))
+    responses.add(responses.GET, 'https://sdk.molasses.app/v1/features',
+                  json=responseD, status=200)
+
+    leader = MolassesClient("test_key", polling=True, snapshot_path=path, shared_snapshot=True)
+    follower = MolassesClient("test_key", polling=True, snapshot_path=path, shared_snapshot=True,
+                              shared_snapshot_interval=0.02)
+    assert leader.is_leader is True
+    assert follower.is_leader is False
+    assert len(responses.calls) == 1
+    assert follower.is_active("FOO_TEST") is True
+
+    save_snapshot_file(path, responseA["data"]["features"])
+    assert wait_for(lambda: follower.is_active("FOO_TEST", {"id": "food", "params": {
+        "isScaredUser": "true"}}) is False)
+    assert follower.snapshot.source == "disk"
+
+    leader.stop()
+    assert wait_for(lambda: follower.is_leader)
+    assert len(responses.calls) == 2
+    follower.stop()
+
+
+@responses.activate
+def test_shared_snapshot_freshness(tmpdir):
+    path = str(tmpdir.join("features.json"))
+
+    def features(request):
+        if request.headers.get("If-None-Match") == '"v1"':
+            return (304, {}, "")
+        return (200, {"ETag": '"v1"'}, json.dumps(responseD))
+
+    responses.add_callback(responses.GET, 'https://sdk.molasses.app/v1/features', callback=features)
+    leader = MolassesClient("test_key", polling=True, polling_interval=0.02, polling_max_interval=0.02,
+                            polling_jitter=0, snapshot_path=path, shared_snapshot=True,
+                            shared_snapshot_interval=0.02)
+    follower = MolassesClient("test_key", polling=True, snapshot_path=path, shared_snapshot=True,
+                              shared_snapshot_interval=0.02)
+    try:
+        saved_at = follower.snapshot.updated_at
+        version = follower.snapshot.version
+        assert wait_for(lambda: follower.snapshot.updated_at > saved_at + 0.1)
+        assert follower.snapshot.version == version
+        assert follower.snapshot_age < 0.5
+    finally:
+        follower.stop()
+        leader.stop()
+
+
+@responses.activate
+def test_on_change():
+    kept = [f for f in responseD["data"]["features"] if f["key"] != "FOO_ID_TEST"]
+    payloads = [responseD, responseD, {"data": {"features": kept}}, {"data": {"features": []}}]
+
+    def features(request):
+        payload = payloads[0] if len(payloads) == 1 else payloads.pop(0)
+        return (200, {}, json.dumps(payload))
+
+    responses.add_callback(responses.GET, 'https://sdk.molasses.app/v1/features',
+                           callback=features)
+
+    changes = []
+    molasses = MolassesClient("test_key", polling=True, polling_interval=0.02,
+                              polling_max_interval=0.02)
+    molasses.on_change(changes.append)
+    assert wait_for(lambda: len(changes) == 2)
+    molasses.stop()
+    assert changes == [["FOO_ID_TEST"], [f["key"] for f in kept]]
+    assert molasses.is_active("FOO_TEST") is False
+    assert len(molasses.snapshot.features) == 0
 
 
 @responses.activate
@@ -394,6 +712,19 @@ def test_more_advanced():
                               "isBetaUser": "true"}}) is True
 
 
+@responses.activate
+def test_result_cache():
+    responses.add(responses.GET, 'https://sdk.molasses.app/v1/features',
+                  json=responseB, status=200)
+
+    molasses = MolassesClient("test_key", polling=True, result_cache_size=100)
+    user = {"id": "foodie", "params": {"isBetaUser": "true"}}
+    assert molasses.is_active("FOO_TEST", user) is True
+    assert molasses.is_active("FOO_TEST", user) is True
+    assert molasses.result_cache.stats() == {"hits": 1, "misses": 1, "size": 1}
+    molasses.stop()
+
+
 @responses.activate
 def test_even_more_advanced():
     responses.add(responses.GET, 'https://sdk.molasses.app/v1/features',
@@ -582,6 +913,7 @@ def test_even_more_advanced():
             "doesNotEqualBool": "true",
         },
     })
+    molasses.stop()
 
 
 @responses.activate
@@ -606,6 +938,25 @@ def test_percentage_tests():
         "id": "122", "params": {}}) is True
 
 
+@responses.activate
+def test_exposure_dedup():
+    responses.add(responses.GET, 'https://sdk.molasses.app/v1/features',
+                  json=responseD, status=200)
+    responses.add(responses.POST, 'https://sdk.molasses.app/v1/analytics',
+                  json={}, status=200)
+    molasses = MolassesClient("test_key", auto_send_events=True, polling=True,
+                              exposure_window=60)
+    user = {"id": "123", "params": {}}
+    for _ in range(10):
+        molasses.is_active("FOO_TEST", user)
+    molasses.experiment_success("FOO_TEST", user)
+    molasses.stop()
+    analytics = [c for c in responses.calls if c.request.url.endswith("/analytics")]
+    events = [e for c in analytics for e in json.loads(c.request.body)]
+    assert [e["event"] for e in events] == ["experiment_started", "experiment_success"]
+    assert molasses.exposures.suppressed == 9
+
+
 @responses.activate
 def test_experiments():
     responses.add(responses.GET, 'https://sdk.molasses.app/v1/features',
@@ -624,3 +975,9 @@ def test_experiments():
                               "id": "123", "params": {}}) is True
     molasses.experiment_success("FOO_50_PERCENT_TEST", {
         "id": "123", "params": {}})
+    molasses.stop()
+    analytics = [c for c in responses.calls if c.request.url.endswith("/analytics")]
+    events = [e for c in analytics for e in json.loads(c.request.body)]
+    assert [e["event"] for e in events] == [
+        "experiment_started", "experiment_started", "experiment_success"]
+    assert events[0]["tags"] == "{}"
@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+
+"""Tests for `molasses.offline`."""
+
+import json
+import threading
+
+import pytest
+
+from molasses import MolassesClient, offline
+from molasses.offline import FileWatcher, read_features_file
+
+from .helpers import make_feature, write_features
+
+
+@pytest.mark.parametrize("inotify", [True, False])
+def test_file_watcher(tmpdir, monkeypatch, inotify):
+    if not inotify:
+        monkeypatch.setattr(offline, "_load_inotify", lambda: None)
+    path = str(tmpdir.join("features.json"))
+    write_features(path, [])
+    changed = threading.Event()
+    watcher = FileWatcher(path, changed.set, interval=0.02)
+    watcher.start()
+    try:
+        if inotify and not watcher.uses_inotify:
+            pytest.skip("inotify is not available")
+        tmpdir.join("unrelated.json").write("{}")
+        assert changed.wait(0.2) is False
+        write_features(path, [make_feature([])])
+        assert changed.wait(5) is True
+    finally:
+        watcher.stop()
+
+
+def test_unusable_features_file(tmpdir):
+    path = tmpdir.join("features.json")
+    path.write('{"features": []}')
+    assert read_features_file(str(path)) is None
+    assert read_features_file(str(tmpdir.join("missing.json"))) is None
+
+
+def test_offline_client(tmpdir):
+    path = str(tmpdir.join("features.json"))
+    events_path = str(tmpdir.join("events.jsonl"))
+    bar = dict(make_feature([]), key="BAR_TEST")
+    write_features(path, [make_feature([]), bar])
+
+    changes = []
+    changed = threading.Event()
+    molasses = MolassesClient("test_key", features_file=path, features_file_interval=0.02,
+                              events_file=events_path)
+    molasses.on_change(lambda keys: (changes.append(keys), changed.set()))
+    assert molasses.is_ready is True
+    assert molasses.is_active("BAR_TEST") is True
+    molasses.track("Clicked", {"id": "foo", "params": {"plan": "pro"}})
+
+    write_features(path, [make_feature([])])
+    assert changed.wait(5) is True
+    molasses.stop()
+    assert changes == [["BAR_TEST"]]
+    assert molasses.is_active("BAR_TEST") is False
+    with open(events_path) as f:
+        events = [json.loads(line) for line in f]
+    assert events == [{"event": "Clicked", "tags": {"plan": "pro"}, "userId": "foo"}]
+
+
+def test_offline_client_stays_off_the_network(tmpdir):
+    path = str(tmpdir.join("features.json"))
+    write_features(path, [make_feature([])])
+    molasses = MolassesClient("test_key", features_file=path)
+    assert molasses.transport is None
+    molasses.track("Clicked", {"id": "foo", "params": {}})
+    molasses.experiment_started("FOO_TEST", {"id": "foo", "params": {}})
+    assert molasses.events.flush(5) is True
+    molasses.stop()
+    assert molasses.events.enqueued == 2
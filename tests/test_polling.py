@@ -0,0 +1,27 @@
+#!/usr/bin/env python
+
+"""Tests for `molasses.polling`."""
+
+import pytest
+
+from molasses.polling import AdaptiveInterval
+
+
+def test_backs_off_when_idle_and_tightens_after_changes():
+    interval = AdaptiveInterval(10, 40, backoff=2, jitter=0)
+    assert [interval.next(False) for _ in range(4)] == [20, 40, 40, 40]
+    assert interval.next(True) == 10
+    assert interval.next(False) == 20
+
+
+def test_jitter_stays_in_bounds():
+    interval = AdaptiveInterval(10, 10, jitter=0.2)
+    delays = [interval.next(False) for _ in range(200)]
+    assert min(delays) >= 8
+    assert max(delays) <= 12
+    assert len(set(delays)) > 1
+
+
+def test_rejects_inverted_bounds():
+    with pytest.raises(ValueError):
+        AdaptiveInterval(10, 5)
@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+
+"""Tests for `molasses.snapshot`."""
+
+import pytest
+
+from molasses.snapshot import (EMPTY_SNAPSHOT, read_snapshot_file, save_snapshot_file,
+                               updated_snapshot)
+
+from .helpers import make_feature
+
+
+def test_versions_only_grow_on_change():
+    first, changed = updated_snapshot(EMPTY_SNAPSHOT, [])
+    assert first.version == 1
+    assert changed == []
+    second, changed = updated_snapshot(first, [make_feature([])])
+    assert second.version == 2
+    assert changed == ["FOO_TEST"]
+    third, changed = updated_snapshot(second, [make_feature([])])
+    assert third.version == 2
+    assert third.features is second.features
+    assert changed == []
+    assert "FOO_TEST" not in first.features
+
+
+def test_snapshots_are_read_only():
+    snapshot, _ = updated_snapshot(EMPTY_SNAPSHOT, [make_feature([])])
+    with pytest.raises(TypeError):
+        snapshot.features["BAR"] = None
+    with pytest.raises(AttributeError):
+        snapshot.version = 5
+
+
+def test_snapshot_file_round_trip(tmpdir):
+    path = str(tmpdir.join("features.json"))
+    save_snapshot_file(path, [make_feature([])], saved_at=1000.0)
+    assert read_snapshot_file(path) == (1000.0, [make_feature([])])
+    assert tmpdir.listdir() == [tmpdir.join("features.json")]
+
+
+def test_unusable_snapshot_files(tmpdir):
+    assert read_snapshot_file(str(tmpdir.join("missing.json"))) is None
+    corrupt = tmpdir.join("corrupt.json")
+    corrupt.write("{not json")
+    assert read_snapshot_file(str(corrupt)) is None
+
+
+def test_missing_features_are_removed():
+    bar = dict(make_feature([]), key="BAR_TEST")
+    first, _ = updated_snapshot(EMPTY_SNAPSHOT, [make_feature([]), bar])
+    second, changed = updated_snapshot(first, [bar])
+    assert changed == ["FOO_TEST"]
+    assert list(second.features) == ["BAR_TEST"]
+    assert second.features["BAR_TEST"] is first.features["BAR_TEST"]
+    assert second.version == 2
+    kept, changed = updated_snapshot(first, [bar], remove_missing=False)
+    assert changed == []
+    assert kept.features is first.features
@@ -0,0 +1,34 @@
+#!/usr/bin/env python
+
+"""Tests for `molasses.stream`."""
+
+from molasses.stream import ReconnectBackoff
+
+
+def test_backoff_grows_and_caps():
+    backoff = ReconnectBackoff(max_delay=8, jitter=0)
+    assert [backoff.next() for _ in range(7)] == [1, 2, 4, 6, 8, 8, 8]
+    assert backoff.attempts == 7
+
+
+def test_backoff_resets_after_healthy_connection():
+    backoff = ReconnectBackoff(jitter=0, reset_after=0)
+    backoff.next()
+    backoff.next()
+    backoff.connected()
+    assert backoff.next() == 1
+
+    backoff = ReconnectBackoff(jitter=0, reset_after=60)
+    backoff.next()
+    backoff.connected()
+    assert backoff.next() == 2
+
+
+def test_backoff_jitter_stays_in_bounds():
+    backoff = ReconnectBackoff(max_delay=10, jitter=0.3)
+    backoff.attempts = 10
+    delays = []
+    for _ in range(200):
+        delays.append(backoff.next())
+    assert min(delays) >= 7
+    assert max(delays) <= 10
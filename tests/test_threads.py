@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+
+"""Tests for using one client from many threads at once."""
+
+import threading
+
+from molasses import MolassesClient
+from molasses.events import EventQueue
+from molasses.metrics import ShardedCounter
+
+from .helpers import make_feature, write_features
+
+THREADS = 8
+CALLS = 2000
+
+
+def run_threads(target, count=THREADS):
+    errors = []
+    start = threading.Barrier(count)
+
+    def run(index):
+        start.wait()
+        try:
+            target(index)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return errors
+
+
+def test_sharded_counter():
+    counter = ShardedCounter()
+
+    def add(index):
+        for _ in range(10000):
+            counter.add()
+        counter.add(index)
+
+    assert run_threads(add) == []
+    assert counter.value == THREADS * 10000 + sum(range(THREADS))
+
+
+def test_sharded_counter_folds_exited_threads():
+    counter = ShardedCounter()
+    for _ in range(500):
+        thread = threading.Thread(target=counter.add, args=(2,))
+        thread.start()
+        thread.join()
+    assert counter.value == 1000
+    assert counter.cells == 0
+    counter.add()
+    assert counter.value == 1001
+    assert counter.cells == 1
+
+
+def test_event_queue_counts_and_flushes_from_many_threads():
+    sent = []
+    events = EventQueue(sent.extend, max_size=THREADS * CALLS, batch_size=50, linger=0.01)
+
+    def put(index):
+        for i in range(CALLS):
+            events.put({"thread": index, "i": i})
+            if i % 500 == 0:
+                assert events.flush(5) is True
+
+    assert run_threads(put) == []
+    assert events.flush(5) is True
+    events.stop()
+    assert events.enqueued == THREADS * CALLS
+    assert events.dropped == 0
+    assert len(sent) == THREADS * CALLS
+
+
+def test_evaluating_while_features_change(tmpdir):
+    path = str(tmpdir.join("features.json"))
+    events_path = str(tmpdir.join("events.jsonl"))
+    bar = dict(make_feature([{"userParam": "plan", "operator": "equals", "values": "pro"}]),
+               key="BAR_TEST")
+    write_features(path, [make_feature([]), bar])
+    changes = []
+    molasses = MolassesClient("test_key", features_file=path, features_file_interval=0.01,
+                              events_file=events_path, events_queue_size=THREADS * CALLS,
+                              result_cache_size=1000)
+    molasses.on_change(changes.append)
+    users = [{"id": "user-%d" % i, "params": {"plan": "pro" if i % 2 else "free"}} for i in range(50)]
+    contexts = [molasses.prepare_user(user) for user in users]
+
+    def write():
+        for i in range(50):
+            write_features(path, [make_feature([], percentage=i * 2), bar])
+
+    writer = threading.Thread(target=write)
+    writer.start()
+
+    def evaluate(index):
+        for i in range(CALLS):
+            user = users[(index + i) % len(users)]
+            context = contexts[(index + i) % len(contexts)]
+            assert molasses.is_active("FOO_TEST", user) in (True, False)
+            assert molasses.is_active("BAR_TEST", context) is (user["params"]["plan"] == "pro")
+            molasses.track("Clicked", user)
+
+    try:
+        assert run_threads(evaluate) == []
+        writer.join()
+        assert molasses.events.flush(5) is True
+    finally:
+        molasses.stop()
+
+    assert changes
+    assert all(keys == ["FOO_TEST"] for keys in changes)
+    stats = molasses.result_cache.stats()
+    assert stats["hits"] + stats["misses"] == 2 * THREADS * CALLS
+    assert molasses.events.enqueued == THREADS * CALLS
+    with open(events_path) as f:
+        assert sum(1 for _ in f) == THREADS * CALLS
@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+
+"""Tests for `molasses.user`."""
+
+import random
+
+import pytest
+
+from molasses.evaluation import compile_feature, get_user_percentage, is_feature_active
+from molasses.events import experiment_event, track_event
+from molasses.user import MISSING, UserContext
+
+from .helpers import make_feature
+
+
+def test_context_matches_dict_evaluation():
+    feature = compile_feature(make_feature([
+        {"userParam": "country", "operator": "in", "values": "us,ca"},
+        {"userParam": "age", "userParamType": "number", "operator": "gte", "values": 21},
+        {"userParam": "app", "userParamType": "semver", "operator": "lt", "values": "2.0.0"},
+        {"userParam": "beta", "userParamType": "boolean", "operator": "equals", "values": True},
+        {"userParam": "id", "operator": "equals", "values": "u7"},
+    ], constraint="any", percentage=37))
+    rng = random.Random(3)
+    for i in range(500):
+        params = {}
+        for param, choices in (("country", ["us", "mx"]), ("age", [18, "30", True]),
+                               ("app", ["1.9.9", "2.0.0", "bad"]), ("beta", [True, "false"])):
+            if rng.random() < 0.7:
+                params[param] = rng.choice(choices)
+        user = {"id": "u%d" % i, "params": params}
+        assert is_feature_active(feature, UserContext(user)) == is_feature_active(feature, user)
+    assert is_feature_active(feature, UserContext({})) is True
+
+
+def test_context_buckets_and_memoizes():
+    context = UserContext({"id": "user-1234567", "params": {"age": "30"}})
+    assert (context.bucket < 50) == get_user_percentage("user-1234567", 50)
+    assert context.typed("age", float) == 30.0
+    assert context.typed_values == {("age", float): 30.0}
+    assert context.typed("plan", str) is MISSING
+    with pytest.raises(ValueError):
+        UserContext({"id": "1", "params": {"age": "old"}}).typed("age", float)
+
+
+def test_context_reads_like_the_user():
+    user = {"id": "foo", "params": {"plan": "pro"}}
+    context = UserContext(user)
+    assert "id" in context and "params" in context
+    assert track_event("Clicked", context) == track_event("Clicked", user)
+    feature = compile_feature(make_feature([]))
+    assert (experiment_event("experiment_started", "FOO_TEST", feature, context, True)
+            == experiment_event("experiment_started", "FOO_TEST", feature, user, True))